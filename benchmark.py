@@ -0,0 +1,545 @@
+"""Benchmarks fuera de línea del bot.
+
+Todo corre contra sustitutos locales: medios generados con ffmpeg (lavfi)
+servidos por HTTP en localhost, una API de YouTube falsa y un archivo .flv
+en lugar de la ingesta RTMP. Los resultados se guardan en JSON para
+comparar ejecuciones.
+
+Uso:
+    python benchmark.py [catalogo] [pipeline] [--salida r.json] [--comparar anterior.json]
+"""
+import argparse
+import atexit
+import functools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Caché, índices y cuota del benchmark en un directorio propio, nunca en el de producción
+DIRECTORIO_BENCH = tempfile.mkdtemp(prefix="relax_bench_")
+atexit.register(shutil.rmtree, DIRECTORIO_BENCH, ignore_errors=True)
+os.environ.setdefault("MEDIA_CACHE_DIR", os.path.join(DIRECTORIO_BENCH, "media_cache"))
+
+import main
+
+TAMANOS_CATALOGO = [100, 1000, 10000, 50000]
+ELECCIONES = 2000
+
+PALABRAS_RELLENO = ["relajante", "para", "dormir", "cabaña", "departamento", "suave", "sala", "ático"]
+
+# Variantes que aparecen en nombres reales del manifiesto
+VARIANTES = [str.capitalize, str.upper, lambda p: p.replace("rio", "río"), lambda p: p + ","]
+
+def catalogo_sintetico(tamano, semilla=0):
+    generador = random.Random(semilla)
+    claves = [palabra for palabras in main.PALABRAS_CLAVE.values() for palabra in palabras]
+
+    def nombre(i):
+        palabras = generador.sample(PALABRAS_RELLENO, 2) + [generador.choice(VARIANTES)(generador.choice(claves))]
+        generador.shuffle(palabras)
+        return " ".join(palabras) + f" {i}"
+
+    return {
+        "videos": [{"name": nombre(i), "url": f"https://medios.local/v/{i}"} for i in range(tamano)],
+        "musica": [],
+        "sonidos_naturaleza": [{"name": nombre(i), "url": f"https://medios.local/a/{i}"} for i in range(tamano)]
+    }
+
+def determinar_categoria_lineal(nombre_video):
+    # Implementación anterior: palabras x categorías en cada llamada
+    nombre = nombre_video.lower()
+    contador = {categoria: 0 for categoria in main.PALABRAS_CLAVE}
+    for palabra in nombre.split():
+        for categoria, palabras in main.PALABRAS_CLAVE.items():
+            if palabra in palabras:
+                contador[categoria] += 1
+    max_categoria = max(contador, key=contador.get)
+    return max_categoria if contador[max_categoria] > 0 else random.choice(list(main.PALABRAS_CLAVE.keys()))
+
+def seleccionar_audio_lineal(medios, categoria_video):
+    # Implementación anterior: recorre todos los sonidos en cada elección
+    compatibles = [
+        audio for audio in medios['sonidos_naturaleza']
+        if any(palabra in audio['name'].lower() for palabra in main.PALABRAS_CLAVE[categoria_video])
+    ]
+    return random.choice(compatibles or medios['sonidos_naturaleza'])
+
+def medir(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+def benchmark_catalogo(opciones):
+    """Coste por elección (µs) del emparejamiento lineal frente al índice."""
+    print(f"{'medios':>8} {'indexar ms':>11} {'lineal µs':>10} {'índice µs':>10} {'aciertos lin.':>14} {'aciertos ind.':>14}")
+    categorias = list(main.PALABRAS_CLAVE)
+    resultados = {}
+    for tamano in TAMANOS_CATALOGO:
+        medios = catalogo_sintetico(tamano)
+        videos = medios['videos']
+
+        inicio = time.perf_counter()
+        indice = main.IndiceCatalogo(medios)
+        indexar_ms = (time.perf_counter() - inicio) * 1000
+
+        def eleccion_lineal():
+            video = random.choice(videos)
+            seleccionar_audio_lineal(medios, determinar_categoria_lineal(video['name']))
+
+        def eleccion_indexada():
+            video = indice.elegir('videos', [random.choice(categorias)])
+            indice.elegir('sonidos_naturaleza', [main.determinar_categoria(video['name'])])
+
+        # Con el catálogo grande la versión lineal es lenta: menos repeticiones
+        repeticiones = max(20, ELECCIONES * 100 // tamano)
+        lineal = medir(eleccion_lineal, min(repeticiones, ELECCIONES))
+        indexada = medir(eleccion_indexada, ELECCIONES)
+
+        muestra = videos[:1000]
+        aciertos_lineal = sum(
+            1 for v in muestra
+            if any(p in v['name'].lower().split() for ps in main.PALABRAS_CLAVE.values() for p in ps)
+        ) / len(muestra)
+        aciertos_indice = sum(1 for v in muestra if main.categoria_de(v['name'])) / len(muestra)
+        print(
+            f"{tamano:>8} {indexar_ms:>11.1f} {lineal:>10.1f} {indexada:>10.1f} "
+            f"{aciertos_lineal:>14.0%} {aciertos_indice:>14.0%}"
+        )
+        resultados[str(tamano)] = {
+            "indexar_ms": round(indexar_ms, 2),
+            "lineal_us": round(lineal, 2),
+            "indice_us": round(indexada, 2),
+            "aciertos_lineal": aciertos_lineal,
+            "aciertos_indice": aciertos_indice
+        }
+    return resultados
+
+class ServidorMedios(BaseHTTPRequestHandler):
+    """Sirve un directorio con ETag y rangos, como lo haría el origen de los medios."""
+
+    directorio = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        ruta = os.path.join(self.directorio, os.path.basename(self.path.split("?")[0]))
+        if not os.path.isfile(ruta):
+            self.send_error(404)
+            return
+        estado = os.stat(ruta)
+        etag = f'"{estado.st_size:x}-{int(estado.st_mtime):x}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        desde = 0
+        rango = self.headers.get('Range')
+        if rango and self.headers.get('If-Range', etag) == etag:
+            desde = int(rango.split("=")[1].split("-")[0])
+        with open(ruta, 'rb') as f:
+            f.seek(desde)
+            cuerpo = f.read()
+
+        self.send_response(206 if desde else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', "application/json" if ruta.endswith(".json") else "application/octet-stream")
+        self.send_header('Content-Length', str(len(cuerpo)))
+        if desde:
+            self.send_header('Content-Range', f"bytes {desde}-{estado.st_size - 1}/{estado.st_size}")
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+class PeticionFalsa:
+    def __init__(self, servicio, respuesta, metodo):
+        self.servicio = servicio
+        self.respuesta = respuesta
+        self.methodId = metodo
+
+    def execute(self, http=None):
+        time.sleep(self.servicio.latencia)
+        self.servicio.llamadas += 1
+        return self.respuesta() if callable(self.respuesta) else self.respuesta
+
+class LoteFalso:
+    def __init__(self, servicio):
+        self.servicio = servicio
+        self.peticiones = []
+
+    def add(self, peticion, callback):
+        self.peticiones.append((peticion, callback))
+
+    def execute(self):
+        # Un lote es un único viaje de ida y vuelta
+        time.sleep(self.servicio.latencia)
+        self.servicio.llamadas += 1
+        for indice, (peticion, callback) in enumerate(self.peticiones):
+            respuesta = peticion.respuesta
+            callback(str(indice), respuesta() if callable(respuesta) else respuesta, None)
+
+class YouTubeFalso:
+    """Imita la parte de la API Data v3 que usa YouTubeManager; la ingesta es un archivo."""
+
+    def __init__(self, sumidero, latencia=0.05):
+        self.sumidero = sumidero
+        # La ingesta de respaldo es otro directorio con el mismo nombre de stream (salida del tee)
+        self.respaldo = os.path.join(os.path.dirname(sumidero), "respaldo")
+        os.makedirs(self.respaldo, exist_ok=True)
+        self.latencia = latencia
+        self.llamadas = 0
+        self.broadcasts = 0
+        self.estados = {}
+
+    def recurso(self, recurso, **metodos):
+        return type("RecursoFalso", (), {
+            nombre: (lambda respuesta, metodo: lambda _self, **kwargs: PeticionFalsa(
+                self, functools.partial(respuesta, **kwargs) if callable(respuesta) else respuesta, metodo
+            ))(
+                respuesta, f"youtube.{recurso}.{nombre}"
+            )
+            for nombre, respuesta in metodos.items()
+        })()
+
+    def stream(self, **kwargs):
+        return {
+            "id": "stream-bench",
+            "cdn": {"ingestionInfo": {
+                "ingestionAddress": os.path.dirname(self.sumidero),
+                "backupIngestionAddress": self.respaldo,
+                "streamName": os.path.basename(self.sumidero)
+            }},
+            "status": {"streamStatus": self.estado_ingesta()}
+        }
+
+    def estado_ingesta(self):
+        # YouTube marca el stream activo cuando empiezan a llegar datos
+        activo = os.path.exists(self.sumidero) and os.path.getsize(self.sumidero) > 64 * 1024
+        return "active" if activo else "ready"
+
+    def nuevo_broadcast(self, **kwargs):
+        self.broadcasts += 1
+        return {"id": f"broadcast-{self.broadcasts}"}
+
+    def liveBroadcasts(self):
+        return self.recurso(
+            "liveBroadcasts", insert=self.nuevo_broadcast, bind={}, transition=self.transicion,
+            list=self.estado_broadcast, delete=""
+        )
+
+    def transicion(self, broadcastStatus, id, **kwargs):
+        # Sin fase testStarting/liveStarting: el estado pedido se ve en el siguiente list
+        self.estados[id] = broadcastStatus
+        return {"id": id}
+
+    def estado_broadcast(self, id, **kwargs):
+        return {"items": [{"id": id, "status": {"lifeCycleStatus": self.estados.get(id, "ready")}}]}
+
+    def liveStreams(self):
+        return self.recurso("liveStreams", insert=self.stream, list=lambda **kwargs: {"items": [self.stream()]})
+
+    def thumbnails(self):
+        return self.recurso("thumbnails", set={})
+
+    def new_batch_http_request(self):
+        return LoteFalso(self)
+
+def generar_medios(directorio, duracion):
+    """Video 720p30 (no cumple el perfil: fuerza la pre-codificación completa), un mp3 y dos pistas."""
+    video = os.path.join(directorio, "cabana_lluvia.mp4")
+    audio = os.path.join(directorio, "lluvia.mp3")
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={duracion}",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-g", "250",
+        video
+    ], check=True)
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:duration={duracion}:sample_rate=44100",
+        "-ac", "2", "-c:a", "libmp3lame", "-b:a", "128k",
+        audio
+    ], check=True)
+    pistas = []
+    for i, frecuencia in enumerate((220, 330)):
+        pista = os.path.join(directorio, f"pista{i}.mp3")
+        subprocess.run([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"sine=frequency={frecuencia}:duration={duracion}:sample_rate=44100",
+            "-ac", "2", "-c:a", "libmp3lame", "-b:a", "128k",
+            pista
+        ], check=True)
+        pistas.append(pista)
+    return video, audio, pistas
+
+def muestrear_encoder(canal, hasta, muestras):
+    """Velocidad y núcleos de CPU del encoder, una muestra por segundo."""
+    anterior = None
+    while time.monotonic() < hasta:
+        time.sleep(1)
+        proceso = canal.proceso
+        if not proceso or proceso.poll() is not None:
+            continue
+        cpu = main.tiempo_cpu_proceso(proceso.pid)
+        ahora = time.monotonic()
+        if cpu is not None and anterior and anterior[0] == proceso.pid:
+            muestras['cpu'].append((cpu - anterior[1]) / (ahora - anterior[2]))
+        anterior = (proceso.pid, cpu, ahora)
+        if canal.telemetria.get('speed') is not None:
+            muestras['speed'].append(canal.telemetria['speed'])
+
+def segundos(valor):
+    # Una emisión que nunca llega a activarse es justo la regresión a registrar
+    return f"{valor:.3f}s" if valor is not None else "n/d"
+
+def media(valores):
+    return round(sum(valores) / len(valores), 3) if valores else None
+
+def benchmark_pipeline(opciones):
+    """Fases de una emisión completa, en frío, contra sustitutos locales."""
+    directorio = os.path.join(DIRECTORIO_BENCH, "origen")
+    os.makedirs(directorio)
+    inicio = time.monotonic()
+    ruta_video, ruta_audio, rutas_pistas = generar_medios(directorio, opciones.duracion_medio)
+    generacion = time.monotonic() - inicio
+    with open(os.path.join(directorio, "medios.json"), 'w') as f:
+        json.dump({
+            "videos": [{"name": "Cabaña Lluvia Bench", "url": "http://{host}/cabana_lluvia.mp4"}],
+            "musica": [
+                {"name": f"Pista Bench {i}", "url": f"http://{{host}}/{os.path.basename(ruta)}"}
+                for i, ruta in enumerate(rutas_pistas)
+            ],
+            "sonidos_naturaleza": [{"name": "Lluvia Bench", "url": "http://{host}/lluvia.mp3"}]
+        }, f)
+
+    ServidorMedios.directorio = directorio
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), ServidorMedios)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    host = f"127.0.0.1:{servidor.server_port}"
+    # El manifiesto lleva el puerto real del servidor local
+    with open(os.path.join(directorio, "medios.json")) as f:
+        contenido = f.read().replace("{host}", host)
+    with open(os.path.join(directorio, "medios.json"), 'w') as f:
+        f.write(contenido)
+    main._manifiesto = main.SincronizadorManifiesto(
+        url=f"http://{host}/medios.json",
+        ruta=os.path.join(DIRECTORIO_BENCH, "manifiesto.json"),
+        semilla=os.path.join(directorio, "medios.json")
+    )
+
+    fases = {"generacion_lavfi": generacion}
+
+    def cronometrar(fase, funcion, *args):
+        inicio = time.monotonic()
+        resultado = funcion(*args)
+        fases[fase] = time.monotonic() - inicio
+        print(f"  {fase:<24} {fases[fase]:8.3f}s")
+        return resultado
+
+    try:
+        gestor = cronometrar("manifiesto", main.GestorContenido, True)
+        cronometrar("manifiesto_304", main.GestorContenido, True)
+        video = gestor.buscar('videos', "Cabaña Lluvia Bench")
+        audio = gestor.buscar('sonidos_naturaleza', "Lluvia Bench")
+
+        cronometrar("descarga", gestor.descargar_lote, [video], [audio])
+        descargas = gestor.descargador.metricas()
+        entrada = gestor.cache.obtener(video['url'])
+        sondeo = main.IndiceProbe(os.path.join(DIRECTORIO_BENCH, "probe_frio.sqlite3"))
+        cronometrar("probe", sondeo.sondear, entrada['ruta'], entrada['sha256'])
+        cronometrar("probe_indexado", sondeo.sondear, entrada['ruta'], entrada['sha256'])
+        cronometrar("preencodificacion", gestor.preencodificar_video, video)
+        cronometrar("miniatura", gestor.generar_miniatura, video)
+        pistas = gestor.elegir_pistas()
+        cronometrar("mezcla", gestor.construir_mezcla, audio, pistas)
+
+        canales = []
+        for i in range(opciones.canales):
+            canal = main.Canal({"nombre": f"bench{i}", "horas": 1})
+            sumidero = os.path.join(DIRECTORIO_BENCH, f"ingesta_{canal.nombre}.flv")
+            youtube = main.YouTubeManager(canal.nombre, servicio=YouTubeFalso(sumidero, opciones.latencia_api))
+            canales.append((canal, youtube))
+        supervisor = main.SupervisorCanales([canal for canal, _ in canales])
+
+        # Preparación en caliente (todo cacheado) y alta del broadcast en la API falsa
+        emisiones = []
+        for canal, youtube in canales:
+            supervisor.admitir(canal)
+            stream_data = main.preparar_transmision_trazada(
+                canal, youtube, {"video": video['name'], "audio": audio['name'], "musica": [p['name'] for p in pistas]}
+            )
+            # Sin esperar a la hora programada: se sale al aire en cuanto la ingesta está activa
+            stream_data['start_time'] = datetime.utcnow()
+            stream_data['end_time'] = datetime.utcnow() + timedelta(seconds=opciones.sostenido + 60)
+            emisiones.append((canal, youtube, stream_data))
+
+        resultados_canales = {}
+        hilos = []
+        for canal, youtube, stream_data in emisiones:
+            inicio = time.monotonic()
+            hilo = threading.Thread(
+                target=main.obtener_trazador().propagar(main.manejar_transmision, stream_data['traza']),
+                args=(stream_data, youtube, canal, supervisor),
+                name=f"emision-{canal.nombre}",
+                daemon=True
+            )
+            hilo.start()
+            hilos.append((canal, stream_data, hilo, inicio))
+
+        for canal, stream_data, hilo, inicio in hilos:
+            primer_cuadro = al_aire = None
+            limite = time.monotonic() + main.ESPERA_ACTIVO_SEGUNDOS
+            while time.monotonic() < limite and (primer_cuadro is None or al_aire is None) and hilo.is_alive():
+                if primer_cuadro is None and (canal.telemetria.get('frame') or 0) > 0:
+                    primer_cuadro = time.monotonic() - inicio
+                if al_aire is None and stream_data['ciclo_vida'].estado == "live":
+                    al_aire = time.monotonic() - inicio
+                time.sleep(0.01)
+            resultados_canales[canal.nombre] = {
+                "tiempo_primer_cuadro": primer_cuadro,
+                "tiempo_al_aire": al_aire,
+                "fases": dict(canal.fases)
+            }
+            print(f"  {canal.nombre}: primer cuadro {segundos(primer_cuadro)}, al aire {segundos(al_aire)}")
+
+        muestras = {canal.nombre: {"cpu": [], "speed": []} for canal, _ in canales}
+        hasta = time.monotonic() + opciones.sostenido
+        muestreos = [
+            threading.Thread(target=muestrear_encoder, args=(canal, hasta, muestras[canal.nombre]), daemon=True)
+            for canal, _ in canales
+        ]
+        for hilo in muestreos:
+            hilo.start()
+        for hilo in muestreos:
+            hilo.join()
+
+        for canal, stream_data, hilo, _ in hilos:
+            resultados_canales[canal.nombre].update({
+                "velocidad_media": media(muestras[canal.nombre]['speed']),
+                "velocidad_minima": min(muestras[canal.nombre]['speed'], default=None),
+                "cpu_nucleos": media(muestras[canal.nombre]['cpu']),
+                "reinicios": canal.total_reinicios
+            })
+            # Terminar la emisión como lo haría el final programado
+            stream_data['end_time'] = datetime.utcnow()
+            canal.evento_salida.set()
+        for canal, stream_data, hilo, _ in hilos:
+            hilo.join(timeout=30)
+            print(
+                f"  {canal.nombre}: {resultados_canales[canal.nombre]['velocidad_media']}x, "
+                f"{resultados_canales[canal.nombre]['cpu_nucleos']} núcleos"
+            )
+
+        return {
+            "fases": {fase: round(segundos, 4) for fase, segundos in fases.items()},
+            "descarga_mb_por_segundo": descargas['mb_por_segundo'],
+            "descarga_bytes": descargas['bytes'],
+            "tiempos_medios": gestor.tiempos,
+            "llamadas_api": sum(youtube.youtube.llamadas for _, youtube in canales),
+            "canales": resultados_canales,
+            "linea_temporal": main.obtener_trazador().linea_temporal()
+        }
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+def benchmark_trazas(opciones):
+    """Coste por tramo de la instrumentación, con y sin traza activa."""
+    trazador = main.Trazador()
+    repeticiones = 100000
+
+    def tramo():
+        with trazador.tramo("bench", canal="bench"):
+            pass
+
+    sin_traza = medir(tramo, repeticiones)
+    with trazador.activar(trazador.iniciar_traza("bench")):
+        con_traza = medir(tramo, repeticiones)
+    print(f"  tramo sin traza activa  {sin_traza:6.2f} µs")
+    print(f"  tramo con traza activa  {con_traza:6.2f} µs")
+    return {"tramo_sin_traza_us": round(sin_traza, 3), "tramo_con_traza_us": round(con_traza, 3)}
+
+BENCHMARKS = {
+    "catalogo": benchmark_catalogo,
+    "trazas": benchmark_trazas,
+    "pipeline": benchmark_pipeline
+}
+
+def aplanar(datos, prefijo=""):
+    planos = {}
+    for clave, valor in datos.items():
+        nombre = f"{prefijo}{clave}"
+        if isinstance(valor, dict):
+            planos.update(aplanar(valor, nombre + "."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            planos[nombre] = valor
+    return planos
+
+def comparar(anterior, actual):
+    """Imprime las métricas que cambiaron más de un 10% respecto a otra ejecución."""
+    viejos = aplanar(anterior['resultados'])
+    nuevos = aplanar(actual['resultados'])
+    print(f"== comparación con {anterior['fecha']} ({anterior.get('commit')}) ==")
+    for nombre in sorted(set(viejos) & set(nuevos)):
+        if viejos[nombre] and abs(nuevos[nombre] - viejos[nombre]) / abs(viejos[nombre]) > 0.10:
+            cambio = (nuevos[nombre] - viejos[nombre]) / abs(viejos[nombre])
+            print(f"  {nombre:<60} {viejos[nombre]:>12.4g} -> {nuevos[nombre]:<12.4g} ({cambio:+.0%})")
+
+def describir_host():
+    def salida(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True, timeout=10).stdout.splitlines()[0]
+        except Exception:
+            return None
+
+    return {
+        "plataforma": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": salida(["ffmpeg", "-version"]),
+        "commit": salida(["git", "-C", os.path.dirname(os.path.abspath(__file__)), "rev-parse", "--short", "HEAD"])
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help=f"Subconjunto de {', '.join(BENCHMARKS)} (por defecto, todos)")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto benchmark_<fecha>.json)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--canales", type=int, default=1, help="Emisiones simultáneas en el pipeline")
+    parser.add_argument("--duracion-medio", type=int, default=30, help="Segundos de los medios generados")
+    parser.add_argument("--sostenido", type=int, default=20, help="Segundos de emisión medidos")
+    parser.add_argument("--latencia-api", type=float, default=0.05, help="Ida y vuelta simulado de la API de YouTube")
+    opciones = parser.parse_args()
+    desconocidos = set(opciones.benchmarks) - set(BENCHMARKS)
+    if desconocidos:
+        parser.error(f"benchmark desconocido: {', '.join(sorted(desconocidos))}")
+
+    host = describir_host()
+    ejecucion = {
+        "fecha": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "commit": host.pop("commit"),
+        "host": host,
+        "opciones": {k: v for k, v in vars(opciones).items() if k not in ("salida", "comparar")},
+        "resultados": {}
+    }
+    for nombre in opciones.benchmarks or BENCHMARKS:
+        print(f"== {nombre} ==")
+        ejecucion['resultados'][nombre] = BENCHMARKS[nombre](opciones)
+
+    salida = opciones.salida or f"benchmark_{datetime.utcnow():%Y%m%d_%H%M%S}.json"
+    with open(salida, 'w') as f:
+        json.dump(ejecucion, f, indent=2, default=str)
+    print(f"📄 Resultados en {salida}")
+
+    if opciones.comparar:
+        with open(opciones.comparar) as f:
+            comparar(json.load(f), ejecucion)
@@ -1,4 +1,5 @@
 import os
+import sys
 import random
 import subprocess
 import logging
@@ -6,22 +7,38 @@ import time
 import requests
 import hashlib
 import shutil
-from datetime import datetime, timedelta
+import tempfile
+import json
+import math
+import sqlite3
+import unicodedata
+import bisect
+import functools
+import itertools
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from collections import deque
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from flask import Flask
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+from flask import Flask, jsonify, request
 from waitress import serve
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlencode
+from requests.adapters import HTTPAdapter
 import threading
-from tenacity import retry, stop_after_attempt, wait_fixed
+import signal
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 app = Flask(__name__)
 
 # Configuración logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s',
     handlers=[logging.StreamHandler()]
 )
 
@@ -33,6 +50,31 @@ YOUTUBE_CREDS = {
     'refresh_token': os.getenv("YOUTUBE_REFRESH_TOKEN")
 }
 
+# Renovación proactiva del token y caché de consultas al API de YouTube
+TOKEN_MARGEN_SEGUNDOS = 300
+CONSULTAS_TTL_SEGUNDOS = 3600
+
+# Cuota diaria del YouTube Data API (se reinicia a medianoche, hora del Pacífico).
+# Las llamadas no esenciales se rechazan al entrar en la reserva.
+CUOTA_DIARIA = int(os.getenv("CUOTA_DIARIA", "10000"))
+CUOTA_RESERVA = int(os.getenv("CUOTA_RESERVA", "1000"))
+COSTES_API = {
+    "liveBroadcasts.insert": 50,
+    "liveBroadcasts.bind": 50,
+    "liveBroadcasts.transition": 50,
+    "liveBroadcasts.delete": 50,
+    "liveBroadcasts.list": 1,
+    "liveStreams.insert": 50,
+    "liveStreams.list": 1,
+    "thumbnails.set": 50
+}
+ESPERA_ACTIVO_SEGUNDOS = 120
+# testStarting/liveStarting pueden durar decenas de segundos
+ESPERA_ESTADO_SEGUNDOS = 90
+
+# El siguiente broadcast se prepara mientras el actual sigue al aire
+ANTELACION_RELEVO = timedelta(minutes=int(os.getenv("ANTELACION_RELEVO_MIN", "30")))
+
 PALABRAS_CLAVE = {
     'lluvia': ['lluvia', 'rain', 'storm'],
     'fuego': ['fuego', 'fire', 'chimenea'],
@@ -41,12 +83,968 @@ PALABRAS_CLAVE = {
     'noche': ['noche', 'night', 'luna']
 }
 
+# Ventana sin repetición: últimos elegidos por tipo de medio que no se vuelven a escoger
+HISTORIAL_SIN_REPETIR = int(os.getenv("HISTORIAL_SIN_REPETIR", "5"))
+
+# Descargas concurrentes: tamaño del pool y conexiones simultáneas por host
+MAX_DESCARGAS = int(os.getenv("MAX_DESCARGAS", "4"))
+DESCARGAS_POR_HOST = int(os.getenv("DESCARGAS_POR_HOST", "2"))
+
+# Carga perezosa: solo se descarga el par elegido (y opcionalmente el siguiente)
+MODO_PEREZOSO = os.getenv("MODO_PEREZOSO", "1") == "1"
+PRECARGAR_SIGUIENTE = os.getenv("PRECARGAR_SIGUIENTE", "1") == "1"
+
+# Caché persistente de medios
+# Parámetros de emisión (deben coincidir con lo que espera la ingesta de YouTube)
+PERFIL_EMISION = {
+    "ancho": 1920,
+    "alto": 1080,
+    "fps": 24,
+    "gop": 48,
+    "video_bitrate": "3000k",
+    "bufsize": "6000k",
+    "audio_bitrate": "96k",
+    "audio_rate": 44100
+}
+
+# Pre-codificación en ingesta: el ffmpeg en vivo solo remultiplexa (-c:v copy)
+PREENCODIFICAR = os.getenv("PREENCODIFICAR", "1") == "1"
+PREENCODIFICAR_PRESET = os.getenv("PREENCODIFICAR_PRESET", "medium")
+
+# Miniaturas: cuadros candidatos muestreados en una sola pasada de decodificación
+MINIATURA_CANDIDATOS = 8
+MINIATURA_ANALISIS = (160, 90)
+
+# Normalización de sonoridad EBU R128 aplicada una sola vez al cachear el audio
+SONORIDAD_OBJETIVO = {"I": -18.0, "TP": -1.5, "LRA": 11.0}
+
+# Fondos de audio pre-renderizados: pistas de "musica" encadenadas con fundido
+# sobre el sonido de naturaleza. Niveles en dB relativos antes de reajustar la
+# suma al objetivo de sonoridad; así el ffmpeg en vivo solo copia un .m4a
+MEZCLA_MUSICA = os.getenv("MEZCLA_MUSICA", "1") == "1"
+MEZCLA_PISTAS = int(os.getenv("MEZCLA_PISTAS", "8"))
+MEZCLA_FUNDIDO = 6.0
+MEZCLA_NIVELES = {"musica": 0.0, "naturaleza": -8.0}
+
+# Multi-canal: CANALES_CONFIG apunta a un JSON con la lista de canales.
+# PRESUPUESTO_CPU son los núcleos que pueden consumir entre todos los ffmpeg.
+CANALES_CONFIG = os.getenv("CANALES_CONFIG")
+PRESUPUESTO_CPU = float(os.getenv("PRESUPUESTO_CPU", str(os.cpu_count() or 1)))
+COSTE_CPU_INICIAL = float(os.getenv("COSTE_CPU_INICIAL", "1.0"))
+
+# Calibración del encoder en vivo (cuando no hay pre-codificación): presets de
+# menor a mayor calidad y número de hilos a probar sobre un clip 1080p24 sintético.
+# MARGEN_TIEMPO_REAL es la holgura exigida sobre tiempo real con todos los canales a la vez.
+CALIBRAR_ENCODER = os.getenv("CALIBRAR_ENCODER", "1") == "1"
+CALIBRACION_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"]
+CALIBRACION_HILOS = [1, 2, 4]
+CALIBRACION_SEGUNDOS = 4
+CALIBRACION_MAX_SEGUNDOS = 180
+MARGEN_TIEMPO_REAL = float(os.getenv("MARGEN_TIEMPO_REAL", "1.5"))
+
+# Reinicios del encoder: el primero es inmediato, luego backoff exponencial con
+# jitter; demasiados fallos en 5 minutos abren el cortacircuitos
+MAX_REINICIOS_VENTANA = 10
+REINICIO_BASE = 0.5
+REINICIO_MAX = 30
+REINICIO_ESTABLE = 60
+REINICIO_ENFRIAMIENTO = 120
+# Encoder en espera publicando en la ingesta de respaldo de YouTube
+ENCODER_RESPALDO = os.getenv("ENCODER_RESPALDO", "0") == "1"
+
+# Fan-out: un solo encode repartido con el muxer tee entre la ingesta principal,
+# la de respaldo, otros RTMP y una grabación local rotativa. Solo el destino
+# principal puede tumbar el encoder; los demás fallan por separado.
+SALIDA_TEE = os.getenv("SALIDA_TEE", "1") == "1"
+# Publicar también en la ingesta de respaldo duplica el ancho de banda de subida: opt-in
+INGESTA_RESPALDO = os.getenv("INGESTA_RESPALDO", "0") == "1"
+SALIDAS_EXTRA = [url.strip() for url in os.getenv("SALIDAS_EXTRA", "").split(",") if url.strip()]
+GRABACION_DIR = os.getenv("GRABACION_DIR")
+GRABACION_SEGMENTO_SEG = int(os.getenv("GRABACION_SEGMENTO_SEG", "600"))
+GRABACION_SEGMENTOS = int(os.getenv("GRABACION_SEGMENTOS", "12"))
+
+CACHE_DIR = os.path.abspath(os.getenv("MEDIA_CACHE_DIR", "./media_cache"))
+CACHE_LIMITE_MB = int(os.getenv("CACHE_LIMITE_MB", "20480"))
+CACHE_REVALIDAR_HORAS = float(os.getenv("CACHE_REVALIDAR_HORAS", "24"))
+
+# Última copia buena del manifiesto; el medios.json incluido en la imagen la inicializa
+MANIFIESTO_LOCAL = os.path.join(CACHE_DIR, "manifiesto.json")
+MANIFIESTO_SEMILLA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "medios.json")
+
+# Trazas en memoria para /debug/timeline: ciclos recientes y cubetas de latencia (s)
+TRAZAS_RECIENTES = int(os.getenv("TRAZAS_RECIENTES", "20"))
+MAX_TRAMOS_TRAZA = 500
+CUBETAS_LATENCIA = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Protege la creación perezosa de las instancias compartidas obtener_*()
+_lock_singletons = threading.Lock()
+
+def escribir_json_atomico(ruta, datos, indent=None):
+    """Escribe en un temporal y lo renombra: nadie lee nunca un JSON a medias."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + ".tmp"
+    with open(temporal, 'w') as f:
+        json.dump(datos, f, indent=indent)
+    os.replace(temporal, ruta)
+
+def huella_parametros(parametros, largo=16):
+    """Hash estable de un dict de parámetros, para claves de caché derivadas."""
+    return hashlib.sha256(json.dumps(parametros, sort_keys=True).encode()).hexdigest()[:largo]
+
+class CacheMedios:
+    """Caché en disco con índice: clave (URL) -> archivo direccionado por contenido."""
+
+    def __init__(self, directorio=CACHE_DIR, limite_bytes=CACHE_LIMITE_MB * 1024 * 1024):
+        self.directorio = directorio
+        self.directorio_objetos = os.path.join(directorio, "objetos")
+        os.makedirs(self.directorio_objetos, exist_ok=True)
+        self.ruta_indice = os.path.join(directorio, "indice.json")
+        self.limite_bytes = limite_bytes
+        self.lock = threading.RLock()
+        self.fijados = {}
+        # Objetos ya sin entrada que siguen en emisión: se borran al soltar la clave
+        self.pendientes = {}
+        # Un cerrojo por clave en producción (descarga, pre-encode, mezcla): dos
+        # canales que eligen el mismo medio no escriben a la vez el mismo .part/.tmp
+        self.en_curso = {}
+        self.entradas = self.cargar_indice()
+        self.limpiar_huerfanos()
+
+    def cargar_indice(self):
+        try:
+            with open(self.ruta_indice) as f:
+                entradas = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"Índice de caché ilegible, se reconstruye: {str(e)}")
+            return {}
+        
+        # Solo se conservan entradas cuyo archivo sigue completo en disco
+        return {
+            clave: entrada for clave, entrada in entradas.items()
+            if os.path.exists(entrada.get('ruta', ''))
+            and os.path.getsize(entrada['ruta']) == entrada.get('tamano')
+        }
+
+    def guardar_indice(self):
+        with self.lock:
+            escribir_json_atomico(self.ruta_indice, self.entradas, indent=1)
+
+    def limpiar_huerfanos(self):
+        referenciados = {entrada['ruta'] for entrada in self.entradas.values()}
+        for nombre in os.listdir(self.directorio_objetos):
+            ruta = os.path.join(self.directorio_objetos, nombre)
+            # Las descargas parciales se conservan para poder reanudarlas
+            if nombre.endswith((".part", ".part.json")):
+                continue
+            if ruta not in referenciados and os.path.isfile(ruta):
+                os.remove(ruta)
+
+    def ruta_objeto(self, nombre):
+        return os.path.join(self.directorio_objetos, nombre)
+
+    @staticmethod
+    def calcular_hash(ruta):
+        sha = hashlib.sha256()
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(bloque)
+        return sha.hexdigest()
+
+    def obtener(self, clave):
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if not entrada:
+                return None
+            if not os.path.exists(entrada['ruta']) or os.path.getsize(entrada['ruta']) != entrada['tamano']:
+                logging.warning(f"♻️ Archivo en caché incompleto, se descarta: {clave}")
+                self.liberar(clave)
+                return None
+            entrada['ultimo_uso'] = time.time()
+            self.guardar_indice()
+            return entrada
+
+    def revalidar(self, clave, url):
+        """Comprueba con ETag/Last-Modified si la copia local sigue vigente."""
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if not entrada:
+                return False
+            if time.time() - entrada.get('revalidado', 0) < CACHE_REVALIDAR_HORAS * 3600:
+                return True
+            etag = entrada.get('etag')
+            last_modified = entrada.get('last_modified')
+        
+        vigente = True
+        if etag or last_modified:
+            cabeceras = {}
+            if etag:
+                cabeceras['If-None-Match'] = etag
+            if last_modified:
+                cabeceras['If-Modified-Since'] = last_modified
+            try:
+                with requests.get(url, headers=cabeceras, stream=True, timeout=20) as r:
+                    if r.status_code == 200:
+                        if etag:
+                            vigente = r.headers.get('ETag') == etag
+                        else:
+                            vigente = r.headers.get('Last-Modified') == last_modified
+            except requests.RequestException as e:
+                logging.warning(f"No se pudo revalidar {clave}, usando copia local: {str(e)}")
+        
+        with self.lock:
+            if not vigente:
+                logging.info(f"🔄 Medio modificado en origen: {clave}")
+                self.liberar(clave)
+                return False
+            if clave in self.entradas:
+                self.entradas[clave]['revalidado'] = time.time()
+                self.guardar_indice()
+            return True
+
+    def registrar(self, clave, ruta_temporal, extension, sha256=None, etag=None, last_modified=None,
+                  metadatos=None):
+        """Mueve un archivo ya verificado a su ruta definitiva y lo indexa."""
+        sha256 = sha256 or self.calcular_hash(ruta_temporal)
+        ruta = self.ruta_objeto(f"{sha256}{extension}")
+        os.replace(ruta_temporal, ruta)
+        
+        ahora = time.time()
+        with self.lock:
+            anterior = self.entradas.get(clave)
+            self.entradas[clave] = {
+                "ruta": ruta,
+                "sha256": sha256,
+                "tamano": os.path.getsize(ruta),
+                "ultimo_uso": ahora,
+                "revalidado": ahora,
+                "etag": etag,
+                "last_modified": last_modified,
+                "validado": True,
+                "metadatos": metadatos or {}
+            }
+            if anterior and anterior['ruta'] != ruta:
+                # El origen cambió: la versión anterior queda huérfana
+                self.descartar_objeto(clave, anterior['ruta'])
+            self.guardar_indice()
+            self.desalojar()
+            return self.entradas.get(clave)
+
+    def liberar(self, clave):
+        with self.lock:
+            entrada = self.entradas.pop(clave, None)
+            if not entrada:
+                return
+            self.descartar_objeto(clave, entrada['ruta'])
+            self.guardar_indice()
+
+    def descartar_objeto(self, clave, ruta):
+        """Borra un objeto que ya no indexa la clave, salvo que otra entrada lo comparta.
+
+        Si la clave está fijada (una emisión lo está usando) el borrado se
+        aplaza hasta que se suelte.
+        """
+        with self.lock:
+            if any(e['ruta'] == ruta for e in self.entradas.values()):
+                return
+            if self.fijados.get(clave):
+                self.pendientes.setdefault(clave, set()).add(ruta)
+                return
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+    def liberar_medio(self, clave):
+        """Libera un medio retirado del manifiesto junto con sus derivados (emisión, miniatura)."""
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if not entrada:
+                return
+            prefijos = (f"emision:{entrada['sha256']}:", f"miniatura:{entrada['sha256']}:")
+            claves = [clave] + [c for c in self.entradas if c.startswith(prefijos)]
+            for c in claves:
+                # Lo que está en emisión se queda hasta que el LRU lo desaloje
+                if not self.fijados.get(c):
+                    logging.info(f"🗑️ Retirado del manifiesto: {c}")
+                    self.liberar(c)
+
+    def desalojar(self):
+        """Elimina las entradas menos usadas hasta respetar el presupuesto de disco."""
+        with self.lock:
+            rutas = {e['ruta']: e['tamano'] for e in self.entradas.values()}
+            total = sum(rutas.values())
+            for clave, entrada in sorted(self.entradas.items(), key=lambda item: item[1]['ultimo_uso']):
+                if total <= self.limite_bytes:
+                    break
+                if self.fijados.get(clave):
+                    continue
+                logging.info(f"🗑️ Desalojando de caché: {clave}")
+                total -= entrada['tamano']
+                self.liberar(clave)
+
+    @contextmanager
+    def exclusivo(self, clave):
+        """Serializa entre hilos la producción de una clave; el segundo encuentra el resultado en caché."""
+        with self.lock:
+            cerrojo, usuarios = self.en_curso.get(clave) or (threading.Lock(), 0)
+            self.en_curso[clave] = (cerrojo, usuarios + 1)
+        try:
+            with cerrojo:
+                yield
+        finally:
+            with self.lock:
+                cerrojo, usuarios = self.en_curso[clave]
+                if usuarios > 1:
+                    self.en_curso[clave] = (cerrojo, usuarios - 1)
+                else:
+                    del self.en_curso[clave]
+
+    def fijar(self, claves):
+        with self.lock:
+            for clave in claves:
+                self.fijados[clave] = self.fijados.get(clave, 0) + 1
+
+    def soltar(self, claves):
+        with self.lock:
+            for clave in claves:
+                if self.fijados.get(clave, 0) > 1:
+                    self.fijados[clave] -= 1
+                else:
+                    self.fijados.pop(clave, None)
+                    for ruta in self.pendientes.pop(clave, ()):
+                        self.descartar_objeto(clave, ruta)
+            self.desalojar()
+
+_cache_medios = None
+
+def obtener_cache():
+    global _cache_medios
+    with _lock_singletons:
+        if _cache_medios is None:
+            _cache_medios = CacheMedios()
+        return _cache_medios
+
+class Trazador:
+    """Tramos (spans) por ciclo de emisión e histogramas de latencia por fase, solo en memoria.
+
+    Cada hilo lleva su traza activa en un threading.local; los tramos sin
+    traza activa solo alimentan los histogramas.
+    """
+
+    def __init__(self, max_trazas=TRAZAS_RECIENTES, cubetas=CUBETAS_LATENCIA):
+        self.trazas = deque(maxlen=max_trazas)
+        self.cubetas = cubetas
+        self.histogramas = {}
+        self.lock = threading.Lock()
+        self.contexto = threading.local()
+        self.ids = itertools.count(1)
+
+    def traza_activa(self):
+        return getattr(self.contexto, 'traza', None)
+
+    def iniciar_traza(self, nombre, **atributos):
+        traza = {
+            "id": next(self.ids),
+            "nombre": nombre,
+            "atributos": atributos,
+            "inicio": time.time(),
+            "inicio_mono": time.monotonic(),
+            "fin_mono": None,
+            "tramos": [],
+            "descartados": 0
+        }
+        with self.lock:
+            self.trazas.append(traza)
+        return traza
+
+    def finalizar_traza(self, traza):
+        if traza and traza['fin_mono'] is None:
+            traza['fin_mono'] = time.monotonic()
+
+    @contextmanager
+    def activar(self, traza):
+        anterior = self.traza_activa()
+        self.contexto.traza = traza
+        try:
+            yield traza
+        finally:
+            self.contexto.traza = anterior
+
+    def propagar(self, funcion, traza=None):
+        """Envuelve funcion para que corra, en otro hilo, dentro de la traza dada o la actual."""
+        traza = traza or self.traza_activa()
+
+        @functools.wraps(funcion)
+        def envuelta(*args, **kwargs):
+            with self.activar(traza):
+                return funcion(*args, **kwargs)
+        return envuelta
+
+    def observar(self, nombre, segundos):
+        with self.lock:
+            histograma = self.histogramas.get(nombre)
+            if histograma is None:
+                histograma = self.histogramas[nombre] = {"cubetas": [0] * (len(self.cubetas) + 1), "suma": 0.0, "total": 0}
+            histograma['cubetas'][bisect.bisect_left(self.cubetas, segundos)] += 1
+            histograma['suma'] += segundos
+            histograma['total'] += 1
+
+    def registrar(self, nombre, inicio_mono, segundos, error=None, **atributos):
+        """Anota un tramo ya medido (inicio en reloj monotónico)."""
+        self.observar(nombre, segundos)
+        traza = self.traza_activa()
+        if traza is None:
+            return
+        if len(traza['tramos']) >= MAX_TRAMOS_TRAZA:
+            traza['descartados'] += 1
+            return
+        traza['tramos'].append({
+            "nombre": nombre,
+            "inicio": inicio_mono,
+            "duracion": segundos,
+            "hilo": threading.current_thread().name,
+            "error": error,
+            "atributos": atributos
+        })
+
+    @contextmanager
+    def tramo(self, nombre, **atributos):
+        inicio = time.monotonic()
+        error = None
+        try:
+            yield atributos
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.registrar(nombre, inicio, time.monotonic() - inicio, error=error, **atributos)
+
+    def linea_temporal(self, limite=None):
+        with self.lock:
+            trazas = list(self.trazas)[-limite:] if limite else list(self.trazas)
+        ahora = time.monotonic()
+        return [
+            {
+                "id": traza['id'],
+                "nombre": traza['nombre'],
+                "atributos": traza['atributos'],
+                "inicio": datetime.utcfromtimestamp(traza['inicio']).isoformat() + "Z",
+                "duracion_ms": round(((traza['fin_mono'] or ahora) - traza['inicio_mono']) * 1000, 1),
+                "abierta": traza['fin_mono'] is None,
+                "descartados": traza['descartados'],
+                "tramos": [
+                    dict(
+                        {k: v for k, v in tramo.items() if k not in ("inicio", "duracion")},
+                        desde_ms=round((tramo['inicio'] - traza['inicio_mono']) * 1000, 1),
+                        duracion_ms=round(tramo['duracion'] * 1000, 1)
+                    )
+                    for tramo in sorted(list(traza['tramos']), key=lambda t: t['inicio'])
+                ]
+            }
+            for traza in reversed(trazas)
+        ]
+
+    def resumen_histogramas(self):
+        with self.lock:
+            return {nombre: dict(h, cubetas=list(h['cubetas'])) for nombre, h in self.histogramas.items()}
+
+_trazador = None
+
+def obtener_trazador():
+    global _trazador
+    with _lock_singletons:
+        if _trazador is None:
+            _trazador = Trazador()
+        return _trazador
+
+def trazado(nombre):
+    """Decorador: cada llamada es un tramo de la traza activa."""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envuelta(*args, **kwargs):
+            with obtener_trazador().tramo(nombre):
+                return funcion(*args, **kwargs)
+        return envuelta
+    return decorador
+
+class SincronizadorManifiesto:
+    """Manifiesto con GET condicional y última copia buena persistida para operar sin red."""
+
+    TIPOS = ("videos", "musica", "sonidos_naturaleza")
+
+    def __init__(self, url=MEDIOS_URL, ruta=MANIFIESTO_LOCAL, semilla=MANIFIESTO_SEMILLA):
+        self.url = url
+        self.ruta = ruta
+        self.semilla = semilla
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self.estado = self.cargar_estado()
+        self.ultima_sincronizacion = None
+        self.ultimo_error = None
+
+    def cargar_estado(self):
+        try:
+            with open(self.ruta) as f:
+                estado = json.load(f)
+            self.validar(estado['datos'])
+            return estado
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Copia local del manifiesto ilegible: {str(e)}")
+        
+        # Primera ejecución: el medios.json incluido en la imagen sirve de semilla
+        try:
+            with open(self.semilla) as f:
+                datos = json.load(f)
+            self.validar(datos)
+            logging.info(f"🌱 Manifiesto inicializado desde {self.semilla}")
+            return {"etag": None, "last_modified": None, "datos": datos, "actualizado": 0}
+        except Exception as e:
+            logging.warning(f"Sin manifiesto semilla utilizable: {str(e)}")
+            return {"etag": None, "last_modified": None, "datos": {tipo: [] for tipo in self.TIPOS}, "actualizado": 0}
+
+    def guardar_estado(self, estado):
+        escribir_json_atomico(self.ruta, estado)
+        self.estado = estado
+
+    def validar(self, datos):
+        if not all(isinstance(datos.get(tipo), list) for tipo in self.TIPOS):
+            raise ValueError("Estructura JSON inválida")
+
+    @classmethod
+    def diferencias(cls, anterior, nuevo):
+        """Entradas añadidas, cambiadas (misma clave, otra URL) y eliminadas por tipo."""
+        cambios = {"añadidos": [], "cambiados": [], "eliminados": []}
+        for tipo in cls.TIPOS:
+            viejos = {m['name']: m for m in anterior.get(tipo, [])}
+            nuevos = {m['name']: m for m in nuevo.get(tipo, [])}
+            for nombre, medio in nuevos.items():
+                if nombre not in viejos:
+                    cambios["añadidos"].append(medio)
+                elif viejos[nombre] != medio:
+                    cambios["cambiados"].append(medio)
+                    if viejos[nombre].get('url') != medio.get('url'):
+                        cambios["eliminados"].append(viejos[nombre])
+            cambios["eliminados"] += [m for nombre, m in viejos.items() if nombre not in nuevos]
+        return cambios
+
+    def sincronizar(self):
+        """Devuelve una copia del manifiesto vigente; sin cambios en origen solo cuesta un 304."""
+        with self.lock:
+            cabeceras = {}
+            if self.estado.get('etag'):
+                cabeceras['If-None-Match'] = self.estado['etag']
+            if self.estado.get('last_modified'):
+                cabeceras['If-Modified-Since'] = self.estado['last_modified']
+            try:
+                respuesta = obtener_descargador().session.get(self.url, headers=cabeceras, timeout=20)
+                if respuesta.status_code == 304:
+                    logging.info("📋 Manifiesto sin cambios (304)")
+                else:
+                    respuesta.raise_for_status()
+                    datos = respuesta.json()
+                    self.validar(datos)
+                    cambios = self.diferencias(self.estado['datos'], datos)
+                    self.guardar_estado({
+                        "etag": respuesta.headers.get('ETag'),
+                        "last_modified": respuesta.headers.get('Last-Modified'),
+                        "datos": datos,
+                        "actualizado": time.time()
+                    })
+                    logging.info(
+                        f"📋 Manifiesto actualizado: +{len(cambios['añadidos'])} "
+                        f"~{len(cambios['cambiados'])} -{len(cambios['eliminados'])}"
+                    )
+                    for medio in cambios['eliminados']:
+                        obtener_cache().liberar_medio(medio['url'])
+                self.ultima_sincronizacion = time.time()
+                self.ultimo_error = None
+            except Exception as e:
+                self.ultimo_error = str(e)
+                logging.warning(f"⚠️ Manifiesto remoto no disponible, usando última copia buena: {str(e)}")
+            
+            # Cada gestor anota rutas y probes en sus entradas: se entrega una copia
+            return {tipo: [dict(m) for m in self.estado['datos'].get(tipo, [])] for tipo in self.TIPOS}
+
+_manifiesto = None
+
+def obtener_manifiesto():
+    global _manifiesto
+    with _lock_singletons:
+        if _manifiesto is None:
+            _manifiesto = SincronizadorManifiesto()
+        return _manifiesto
+
+class IndiceProbe:
+    """Metadatos de ffprobe persistidos en SQLite e indexados por hash de contenido."""
+
+    COLUMNAS = (
+        "duracion", "formato", "video_codec", "ancho", "alto", "fps", "gop", "pix_fmt",
+        "video_bitrate", "audio_codec", "canales", "sample_rate", "sonoridad"
+    )
+
+    def __init__(self, ruta=os.path.join(CACHE_DIR, "probe.sqlite3")):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self.ejecutar(
+            "CREATE TABLE IF NOT EXISTS sondeos ("
+            "sha256 TEXT PRIMARY KEY, duracion REAL, formato TEXT, video_codec TEXT, "
+            "ancho INTEGER, alto INTEGER, fps REAL, gop INTEGER, pix_fmt TEXT, video_bitrate INTEGER, "
+            "audio_codec TEXT, canales INTEGER, sample_rate INTEGER, sonoridad REAL, "
+            "datos TEXT, actualizado REAL)"
+        )
+
+    def ejecutar(self, sql, parametros=()):
+        with self.lock:
+            conexion = sqlite3.connect(self.ruta, timeout=30)
+            conexion.row_factory = sqlite3.Row
+            try:
+                filas = [dict(fila) for fila in conexion.execute(sql, parametros)]
+                conexion.commit()
+                return filas
+            finally:
+                conexion.close()
+
+    def consultar(self, sha256):
+        filas = self.ejecutar("SELECT * FROM sondeos WHERE sha256 = ?", (sha256,))
+        return filas[0] if filas else None
+
+    def buscar(self, **filtros):
+        """Filas cuyas columnas coinciden exactamente con los filtros, p. ej. buscar(video_codec='h264')."""
+        desconocidas = set(filtros) - set(self.COLUMNAS)
+        if desconocidas:
+            raise ValueError(f"Columnas de probe desconocidas: {', '.join(sorted(desconocidas))}")
+        columnas = list(filtros)
+        where = " AND ".join(f"{c} = ?" for c in columnas) or "1"
+        return self.ejecutar(f"SELECT * FROM sondeos WHERE {where}", tuple(filtros[c] for c in columnas))
+
+    def sondear(self, ruta, sha256, sonoridad=None):
+        """Devuelve los metadatos del archivo; solo ejecuta ffprobe si el contenido es nuevo."""
+        fila = self.consultar(sha256)
+        if fila:
+            if sonoridad is not None and fila['sonoridad'] is None:
+                self.ejecutar("UPDATE sondeos SET sonoridad = ? WHERE sha256 = ?", (sonoridad, sha256))
+                fila['sonoridad'] = sonoridad
+            return fila
+        
+        result = subprocess.run([
+            "ffprobe",
+            "-v", "error",
+            "-show_format",
+            "-show_streams",
+            "-of", "json",
+            ruta
+        ], capture_output=True, text=True, timeout=60, check=True)
+        datos = json.loads(result.stdout)
+        video = next((st for st in datos.get('streams', []) if st.get('codec_type') == 'video'), {})
+        audio = next((st for st in datos.get('streams', []) if st.get('codec_type') == 'audio'), {})
+        
+        def entero(valor):
+            try:
+                return int(valor)
+            except (TypeError, ValueError):
+                return None
+        
+        fps = None
+        numerador, _, denominador = (video.get('avg_frame_rate') or "0/0").partition("/")
+        if entero(numerador) and entero(denominador):
+            fps = round(int(numerador) / int(denominador), 3)
+        
+        duracion = datos.get('format', {}).get('duration')
+        fila = {
+            "sha256": sha256,
+            "duracion": float(duracion) if duracion else None,
+            "formato": datos.get('format', {}).get('format_name'),
+            "video_codec": video.get('codec_name'),
+            "ancho": entero(video.get('width')),
+            "alto": entero(video.get('height')),
+            "fps": fps,
+            "gop": self.estimar_gop(ruta) if video else None,
+            "pix_fmt": video.get('pix_fmt'),
+            "video_bitrate": entero(video.get('bit_rate')),
+            "audio_codec": audio.get('codec_name'),
+            "canales": entero(audio.get('channels')),
+            "sample_rate": entero(audio.get('sample_rate')),
+            "sonoridad": sonoridad,
+            "datos": result.stdout,
+            "actualizado": time.time()
+        }
+        self.ejecutar(
+            f"INSERT OR REPLACE INTO sondeos ({', '.join(fila)}) VALUES ({', '.join('?' for _ in fila)})",
+            tuple(fila.values())
+        )
+        return fila
+
+    @staticmethod
+    def estimar_gop(ruta):
+        """Distancia más frecuente (en cuadros) entre keyframes en los primeros 30 s."""
+        result = subprocess.run([
+            "ffprobe",
+            "-v", "error",
+            "-select_streams", "v:0",
+            "-read_intervals", "%+30",
+            "-show_entries", "packet=flags",
+            "-of", "csv=p=0",
+            ruta
+        ], capture_output=True, text=True, timeout=60)
+        claves = [i for i, flags in enumerate(result.stdout.split()) if flags.startswith("K")]
+        distancias = [b - a for a, b in zip(claves, claves[1:])]
+        return max(set(distancias), key=distancias.count) if distancias else None
+
+_indice_probe = None
+
+def obtener_indice_probe():
+    global _indice_probe
+    with _lock_singletons:
+        if _indice_probe is None:
+            _indice_probe = IndiceProbe()
+        return _indice_probe
+
+def bitrate_bps(valor):
+    return int(float(valor.rstrip("kK")) * 1000) if valor.lower().endswith("k") else int(valor)
+
+def cumple_perfil_emision(probe):
+    """True si el video ya es exactamente lo que se emite y puede copiarse sin recodificar."""
+    perfil = PERFIL_EMISION
+    return bool(probe) and (
+        probe['video_codec'] == "h264"
+        and probe['pix_fmt'] == "yuv420p"
+        and (probe['ancho'], probe['alto']) == (perfil['ancho'], perfil['alto'])
+        and probe['fps'] == perfil['fps']
+        and probe['gop'] == perfil['gop']
+        and (probe['video_bitrate'] or 0) <= bitrate_bps(perfil['video_bitrate']) * 1.1
+    )
+
+def filtro_loudnorm(medida=None):
+    """loudnorm hacia SONORIDAD_OBJETIVO: sin medida es la primera pasada (imprime JSON),
+    con la medida de esa pasada es la segunda, lineal."""
+    objetivo = SONORIDAD_OBJETIVO
+    filtro = f"loudnorm=I={objetivo['I']}:TP={objetivo['TP']}:LRA={objetivo['LRA']}"
+    if medida is None:
+        return f"{filtro}:print_format=json"
+    return (
+        f"{filtro}:measured_I={medida['input_i']}:measured_TP={medida['input_tp']}"
+        f":measured_LRA={medida['input_lra']}:measured_thresh={medida['input_thresh']}"
+        f":offset={medida['target_offset']}:linear=true"
+    )
+
+def leer_medida_loudnorm(salida):
+    return json.loads(salida[salida.rindex("{"):salida.rindex("}") + 1])
+
+def duracion_video(probe):
+    """Duración del stream de video; la del contenedor crece si el audio es más largo."""
+    try:
+        streams = json.loads(probe.get('datos') or "{}").get('streams', [])
+    except ValueError:
+        streams = []
+    video = next((st for st in streams if st.get('codec_type') == 'video'), {})
+    try:
+        return float(video['duration'])
+    except (KeyError, TypeError, ValueError):
+        pass
+    try:
+        return int(video['nb_frames']) / probe['fps']
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return probe['duracion']
+
+def misma_resolucion(probe):
+    return bool(probe) and (probe['ancho'], probe['alto']) == (PERFIL_EMISION['ancho'], PERFIL_EMISION['alto'])
+
+class Descargador:
+    """Descargas HTTP reanudables (Range) sobre una sesión con pool de conexiones."""
+
+    def __init__(self, session=None, reintentos=3, tamano_bloque=256 * 1024):
+        self.session = session or requests.Session()
+        adaptador = HTTPAdapter(pool_connections=MAX_DESCARGAS, pool_maxsize=MAX_DESCARGAS * DESCARGAS_POR_HOST)
+        self.session.mount("http://", adaptador)
+        self.session.mount("https://", adaptador)
+        self.reintentos = reintentos
+        self.tamano_bloque = tamano_bloque
+        self.lock = threading.Lock()
+        # Compartidos por todos los gestores (ciclos, precargas, canales) del proceso
+        self.limites_host = {}
+        self.contadores = {
+            "descargas": 0,
+            "fallos": 0,
+            "reintentos": 0,
+            "reanudaciones": 0,
+            "bytes": 0,
+            "segundos": 0.0
+        }
+
+    def contar(self, nombre, valor=1):
+        with self.lock:
+            self.contadores[nombre] += valor
+
+    def limite_host(self, url):
+        # Un semáforo por host para que Google Drive no nos limite
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.limites_host:
+                self.limites_host[host] = threading.BoundedSemaphore(DESCARGAS_POR_HOST)
+            return self.limites_host[host]
+
+    def metricas(self):
+        with self.lock:
+            datos = dict(self.contadores)
+        datos['mb_por_segundo'] = datos['bytes'] / 1e6 / datos['segundos'] if datos['segundos'] else 0.0
+        return datos
+
+    def descargar(self, url, destino):
+        """Descarga url en destino de forma atómica, reanudando el .part si existe.
+
+        Devuelve sha256, etag, last_modified y bytes del archivo completo.
+        """
+        parcial = destino + ".part"
+        for intento in range(1, self.reintentos + 1):
+            try:
+                with self.limite_host(url):
+                    resultado = self.intentar(url, parcial)
+                os.replace(parcial, destino)
+                if os.path.exists(parcial + ".json"):
+                    os.remove(parcial + ".json")
+                self.contar("descargas")
+                return resultado
+            except (requests.RequestException, IOError) as e:
+                if intento == self.reintentos:
+                    self.contar("fallos")
+                    raise
+                self.contar("reintentos")
+                espera = min(2 ** intento, 30)
+                logging.warning(f"Descarga interrumpida ({str(e)}), reintentando en {espera}s...")
+                time.sleep(espera)
+
+    def intentar(self, url, parcial, confirmado=False):
+        ruta_meta = parcial + ".json"
+        meta = {}
+        if os.path.exists(parcial) and os.path.exists(ruta_meta):
+            with open(ruta_meta) as f:
+                meta = json.load(f)
+        desde = os.path.getsize(parcial) if meta.get('etag') or meta.get('last_modified') else 0
+        
+        # Content-Length y los rangos se refieren a la representación codificada:
+        # sin compresión, los bytes contados y reanudados son los del archivo
+        cabeceras = {'Accept-Encoding': 'identity'}
+        if desde:
+            cabeceras['Range'] = f"bytes={desde}-"
+            cabeceras['If-Range'] = meta.get('etag') or meta['last_modified']
+        
+        inicio = time.monotonic()
+        with self.session.get(meta.get('url', url), headers=cabeceras, stream=True, timeout=(15, 30)) as r:
+            if r.status_code == 416:
+                total = r.headers.get('Content-Range', '').rpartition('/')[2]
+                if total.isdigit() and int(total) == desde:
+                    # El .part ya estaba completo
+                    return self.resumen(parcial, meta, CacheMedios.calcular_hash(parcial))
+                os.remove(parcial)
+                raise IOError("Rango no satisfacible, se reinicia la descarga")
+            r.raise_for_status()
+            
+            if 'text/html' in r.headers.get('Content-Type', ''):
+                # Google Drive responde con una página de aviso para archivos grandes
+                nueva_url = None if confirmado else resolver_confirmacion_drive(r.text, r.url)
+                if not nueva_url:
+                    raise IOError("El servidor devolvió HTML en lugar del archivo")
+                logging.info("🔑 Aviso de Google Drive detectado, siguiendo enlace de confirmación")
+                with open(ruta_meta, 'w') as f:
+                    json.dump({'url': nueva_url}, f)
+                return self.intentar(nueva_url, parcial, confirmado=True)
+            
+            # El hash se calcula mientras llegan los bytes; al reanudar se
+            # parte del hash de lo que ya estaba en disco
+            sha = hashlib.sha256()
+            if r.status_code == 206:
+                self.contar("reanudaciones")
+                logging.info(f"⏯️ Reanudando descarga desde {desde / 1e6:.1f} MB")
+                with open(parcial, 'rb') as f:
+                    for bloque in iter(lambda: f.read(self.tamano_bloque), b""):
+                        sha.update(bloque)
+                modo = 'ab'
+            else:
+                modo = 'wb'
+            
+            meta.update({
+                'url': meta.get('url', url),
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified')
+            })
+            with open(ruta_meta, 'w') as f:
+                json.dump(meta, f)
+            
+            esperado = r.headers.get('Content-Length')
+            recibidos = 0
+            try:
+                with open(parcial, modo) as f:
+                    for chunk in r.iter_content(chunk_size=self.tamano_bloque):
+                        if chunk:
+                            sha.update(chunk)
+                            f.write(chunk)
+                            recibidos += len(chunk)
+            finally:
+                self.contar("bytes", recibidos)
+                self.contar("segundos", time.monotonic() - inicio)
+            
+            if esperado and int(esperado) != recibidos:
+                raise IOError(f"Descarga truncada: {recibidos} de {esperado} bytes")
+        
+        return self.resumen(parcial, meta, sha.hexdigest())
+
+    def resumen(self, parcial, meta, sha256):
+        return {
+            "sha256": sha256,
+            "etag": meta.get('etag'),
+            "last_modified": meta.get('last_modified'),
+            "bytes": os.path.getsize(parcial)
+        }
+
+def resolver_confirmacion_drive(html, url):
+    """Extrae de la página de aviso de Drive la URL real de descarga."""
+    formulario = re.search(r'<form[^>]+id="download-form"[^>]+action="([^"]+)"', html)
+    if formulario:
+        campos = dict(re.findall(r'<input type="hidden" name="([^"]+)" value="([^"]*)"', html))
+        return f"{formulario.group(1).replace('&amp;', '&')}?{urlencode(campos)}"
+    
+    token = re.search(r'confirm=([0-9A-Za-z_-]+)', html)
+    if token:
+        separador = '&' if '?' in url else '?'
+        return f"{url}{separador}confirm={token.group(1)}"
+    return None
+
+_descargador = None
+
+def obtener_descargador():
+    global _descargador
+    with _lock_singletons:
+        if _descargador is None:
+            _descargador = Descargador()
+        return _descargador
+
+def puntuar_cuadro(pixeles, ancho, alto):
+    """Nitidez (varianza del laplaciano) ponderada por lo bien expuesto que está el cuadro."""
+    media = sum(pixeles) / len(pixeles)
+    laplaciano = [
+        4 * pixeles[i] - pixeles[i - 1] - pixeles[i + 1] - pixeles[i - ancho] - pixeles[i + ancho]
+        for y in range(1, alto - 1)
+        for i in range(y * ancho + 1, y * ancho + ancho - 1)
+    ]
+    promedio = sum(laplaciano) / len(laplaciano)
+    varianza = sum((valor - promedio) ** 2 for valor in laplaciano) / len(laplaciano)
+    exposicion = max(0.0, 1 - abs(media - 128) / 128)
+    return varianza * exposicion
+
 class GestorContenido:
-    def __init__(self):
-        self.media_cache_dir = os.path.abspath("./media_cache")
-        os.makedirs(self.media_cache_dir, exist_ok=True)
+    def __init__(self, perezoso=MODO_PEREZOSO):
+        self.perezoso = perezoso
+        self.cache = obtener_cache()
+        self.descargador = obtener_descargador()
+        self.probe = obtener_indice_probe()
+        self.media_cache_dir = self.cache.directorio
+        self.tiempos = {}
         self.medios = self.cargar_medios()
-    
+        self.catalogo = IndiceCatalogo(self.medios)
+
     def obtener_extension_segura(self, url):
         extensiones_validas = {'.mp4', '.mov', '.avi', '.mkv', '.webm'}
         try:
@@ -56,119 +1054,636 @@ class GestorContenido:
         except:
             return '.mp4'
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(5))
+    @trazado("descarga_video")
     def descargar_video(self, url):
-        try:
-            if "drive.google.com" in url and "export=download" in url:
-                file_id = url.split('id=')[-1].split('&')[0]
-                url = f"https://drive.google.com/uc?export=download&id={file_id}&confirm=t"
-            
-            nombre_hash = hashlib.md5(url.encode()).hexdigest()
-            ruta_local = os.path.join(self.media_cache_dir, f"{nombre_hash}.mp4")
-            
-            if os.path.exists(ruta_local):
-                return ruta_local
+        url_original = url
+        with self.cache.exclusivo(url):
+            ruta_local = None
+            try:
+                if "drive.google.com" in url and "export=download" in url:
+                    file_id = url.split('id=')[-1].split('&')[0]
+                    url = f"https://drive.google.com/uc?export=download&id={file_id}&confirm=t"
                 
-            logging.info(f"⬇️ Descargando video: {url}")
-            
-            subprocess.run([
-                "wget",
-                "--no-check-certificate",
-                "--progress=dot:giga",
-                "--retry-connrefused",
-                "--waitretry=1",
-                "--read-timeout=20",
-                "--timeout=15",
-                "-t", "3",
-                "-O", ruta_local,
-                url
-            ], check=True, timeout=300)
-
-            self.verificar_video(ruta_local)
-            return ruta_local
-        except Exception as e:
-            logging.error(f"Error descarga video: {str(e)}")
-            if os.path.exists(ruta_local):
-                os.remove(ruta_local)
-            raise
+                entrada = self.cache.obtener(url_original)
+                if entrada and self.cache.revalidar(url_original, url):
+                    return entrada['ruta']
+                
+                nombre_hash = hashlib.md5(url.encode()).hexdigest()
+                ruta_local = self.cache.ruta_objeto(f"{nombre_hash}.descarga")
+                    
+                logging.info(f"⬇️ Descargando video: {url}")
+                
+                inicio = time.monotonic()
+                resultado = self.descargador.descargar(url, ruta_local)
+                tiempo_red = time.monotonic() - inicio
+                obtener_trazador().registrar("red", inicio, tiempo_red, url=url_original, bytes=resultado['bytes'])
+
+                inicio = time.monotonic()
+                self.verificar_video(ruta_local, resultado['sha256'])
+                entrada = self.cache.registrar(
+                    url_original, ruta_local, ".mp4",
+                    sha256=resultado['sha256'],
+                    etag=resultado['etag'],
+                    last_modified=resultado['last_modified']
+                )
+                self.tiempos[url_original] = {
+                    "red": tiempo_red,
+                    "proceso": time.monotonic() - inicio
+                }
+                return entrada['ruta']
+            except Exception as e:
+                logging.error(f"Error descarga video: {str(e)}")
+                if ruta_local and os.path.exists(ruta_local):
+                    os.remove(ruta_local)
+                raise
 
-    def verificar_video(self, path):
+    @trazado("probe")
+    def verificar_video(self, path, sha256):
+        """Valida el video con el índice de probes y devuelve sus metadatos."""
         try:
-            result = subprocess.run([
-                "ffprobe",
-                "-v", "error",
-                "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                path
-            ], capture_output=True, text=True, timeout=30)
-            
-            if not result.stdout.strip() or float(result.stdout) < 10:
-                raise ValueError("Video inválido o demasiado corto")
+            probe = self.probe.sondear(path, sha256)
         except subprocess.TimeoutExpired:
             raise RuntimeError("Timeout verificando video")
+        if not probe['duracion'] or probe['duracion'] < 10 or not probe['video_codec']:
+            raise ValueError("Video inválido o demasiado corto")
+        return probe
+
+    def huella_audio(self):
+        parametros = {
+            "codec": "aac",
+            "bitrate": PERFIL_EMISION['audio_bitrate'],
+            "rate": PERFIL_EMISION['audio_rate'],
+            "sonoridad": SONORIDAD_OBJETIVO
+        }
+        return huella_parametros(parametros)
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(5))
+    @trazado("sonoridad")
+    def medir_sonoridad(self, path):
+        """Primera pasada de loudnorm: mide la sonoridad integrada del audio."""
+        result = subprocess.run([
+            "ffmpeg", "-hide_banner", "-nostats",
+            "-i", path,
+            "-af", filtro_loudnorm(),
+            "-f", "null", "-"
+        ], capture_output=True, text=True, timeout=300, check=True)
+        return leer_medida_loudnorm(result.stderr)
+
+    @trazado("descarga_audio")
     def descargar_audio(self, url):
-        try:
-            nombre_hash = hashlib.md5(url.encode()).hexdigest()
-            ruta_local = os.path.join(self.media_cache_dir, f"{nombre_hash}.wav")
-            
-            if os.path.exists(ruta_local):
-                return ruta_local
+        with self.cache.exclusivo(url):
+            temp_path = None
+            ruta_local = None
+            try:
+                huella = self.huella_audio()
+                entrada = self.cache.obtener(url)
+                if entrada and entrada.get('metadatos', {}).get('huella') == huella and self.cache.revalidar(url, url):
+                    return entrada['ruta']
+                
+                nombre_hash = hashlib.md5(url.encode()).hexdigest()
+                ruta_local = self.cache.ruta_objeto(f"{nombre_hash}.m4a.tmp")
+                temp_path = self.cache.ruta_objeto(f"temp_{nombre_hash}.mp3")
+                
+                inicio = time.monotonic()
+                resultado = self.descargador.descargar(url, temp_path)
+                tiempo_red = time.monotonic() - inicio
+                obtener_trazador().registrar("red", inicio, tiempo_red, url=url, bytes=resultado['bytes'])
+                
+                # Se guarda AAC ya normalizado con los parámetros de emisión, así el
+                # ffmpeg en vivo puede copiar el audio en lugar de recodificarlo
+                inicio = time.monotonic()
+                medida = self.medir_sonoridad(temp_path)
+                self.probe.sondear(temp_path, resultado['sha256'], sonoridad=float(medida['input_i']))
+                inicio_codificacion = time.monotonic()
+                subprocess.run([
+                    "ffmpeg", "-y", "-i", temp_path,
+                    "-vn",
+                    "-af", filtro_loudnorm(medida),
+                    "-c:a", "aac",
+                    "-b:a", PERFIL_EMISION['audio_bitrate'],
+                    "-ar", str(PERFIL_EMISION['audio_rate']),
+                    "-ac", "2",
+                    "-f", "mp4", ruta_local
+                ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                obtener_trazador().registrar(
+                    "codificacion_audio", inicio_codificacion, time.monotonic() - inicio_codificacion, url=url
+                )
                 
-            temp_path = os.path.join(self.media_cache_dir, f"temp_{nombre_hash}.mp3")
-            
-            with requests.get(url, stream=True, timeout=30) as r:
-                r.raise_for_status()
-                with open(temp_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-            
-            subprocess.run([
-                "ffmpeg", "-y", "-i", temp_path,
-                "-acodec", "pcm_s16le", "-ar", "44100", "-ac", "2",
-                ruta_local
-            ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            
-            os.remove(temp_path)
-            return ruta_local
-        except Exception as e:
-            logging.error(f"Error procesando audio: {str(e)}")
-            if os.path.exists(temp_path):
                 os.remove(temp_path)
-            raise
+                entrada = self.cache.registrar(
+                    url, ruta_local, ".m4a",
+                    sha256=resultado['sha256'],
+                    etag=resultado['etag'],
+                    last_modified=resultado['last_modified'],
+                    metadatos={"huella": huella, "sonoridad": medida}
+                )
+                self.tiempos[url] = {
+                    "red": tiempo_red,
+                    "proceso": time.monotonic() - inicio
+                }
+                return entrada['ruta']
+            except Exception as e:
+                logging.error(f"Error procesando audio: {str(e)}")
+                for ruta in (temp_path, ruta_local):
+                    if ruta and os.path.exists(ruta):
+                        os.remove(ruta)
+                raise
+
+    @trazado("sincronizar_manifiesto")
+    def cargar_manifiesto(self):
+        return obtener_manifiesto().sincronizar()
 
     def cargar_medios(self):
         try:
-            respuesta = requests.get(MEDIOS_URL, timeout=20)
-            respuesta.raise_for_status()
-            datos = respuesta.json()
+            datos = self.cargar_manifiesto()
             
-            if not all(key in datos for key in ["videos", "musica", "sonidos_naturaleza"]):
-                raise ValueError("Estructura JSON inválida")
+            if self.perezoso:
+                logging.info(
+                    f"📋 Manifiesto cargado: {len(datos['videos'])} videos, "
+                    f"{len(datos['sonidos_naturaleza'])} sonidos (descarga bajo demanda)"
+                )
+                return datos
             
-            # Descargar videos
-            for medio in datos['videos']:
-                medio['local_path'] = self.descargar_video(medio['url'])
-                if not medio['local_path']:
-                    raise RuntimeError(f"Fallo descarga video: {medio['name']}")
-            
-            # Descargar sonidos
-            for medio in datos['sonidos_naturaleza']:
-                medio['local_path'] = self.descargar_audio(medio['url'])
-                if not medio['local_path']:
-                    raise RuntimeError(f"Fallo descarga audio: {medio['name']}")
-            
-            logging.info("✅ Medios verificados y listos")
+            inicio = time.monotonic()
+            self.descargar_lote(datos['videos'], datos['sonidos_naturaleza'])
+            logging.info(f"✅ Medios verificados y listos en {time.monotonic() - inicio:.1f}s")
             return datos
         except Exception as e:
             logging.error(f"Error cargando medios: {str(e)}")
             return {"videos": [], "musica": [], "sonidos_naturaleza": []}
 
+    def descargar_lote(self, videos, audios):
+        # Descargar videos y sonidos en paralelo; el ffprobe/ffmpeg de cada
+        # medio se solapa con las transferencias de los demás
+        tareas = [(medio, self.descargar_video, "video") for medio in videos if not medio.get('local_path')]
+        tareas += [(medio, self.descargar_audio, "audio") for medio in audios if not medio.get('local_path')]
+        if not tareas:
+            return
+        
+        pool = ThreadPoolExecutor(max_workers=MAX_DESCARGAS)
+        try:
+            futuros = {
+                pool.submit(obtener_trazador().propagar(funcion), medio['url']): (medio, tipo)
+                for medio, funcion, tipo in tareas
+            }
+            for futuro in as_completed(futuros):
+                medio, tipo = futuros[futuro]
+                medio['local_path'] = futuro.result()
+                if not medio['local_path']:
+                    raise RuntimeError(f"Fallo descarga {tipo}: {medio['name']}")
+                medio['tiempos'] = self.tiempos.get(medio['url'], {})
+                if medio['tiempos']:
+                    logging.info(
+                        f"⏱️ {medio['name']}: red {medio['tiempos']['red']:.1f}s, "
+                        f"proceso {medio['tiempos']['proceso']:.1f}s"
+                    )
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def buscar(self, tipo, nombre):
+        return self.catalogo.buscar(tipo, nombre)
+
+    def disponible(self, medio):
+        return bool(medio.get('local_path') or self.perezoso)
+
+    def elegir_video(self, preferido=None, excluir=None, categorias=None):
+        if preferido:
+            video = self.buscar('videos', preferido)
+            if video:
+                self.catalogo.registrar_eleccion('videos', video)
+                return video
+        return self.catalogo.elegir(
+            'videos', categorias,
+            excluir={excluir} if excluir else (),
+            elegible=self.disponible
+        )
+
+    def elegir_audio(self, categoria, preferido=None):
+        if preferido:
+            audio = self.buscar('sonidos_naturaleza', preferido)
+            if audio:
+                self.catalogo.registrar_eleccion('sonidos_naturaleza', audio)
+                return audio
+        return seleccionar_audio_compatible(self, categoria)
+
+    @staticmethod
+    def clave_emision(entrada_origen):
+        parametros = dict(PERFIL_EMISION, preset=PREENCODIFICAR_PRESET)
+        return f"emision:{entrada_origen['sha256']}:{huella_parametros(parametros)}"
+
+    @trazado("preencodificacion")
+    def preencodificar_video(self, video):
+        """Genera una versión lista para emitir (1080p24, GOP fijo) del video."""
+        entrada_origen = self.cache.obtener(video['url'])
+        if not entrada_origen:
+            return None
+        
+        clave = self.clave_emision(entrada_origen)
+        huella = clave.rpartition(":")[2]
+        video['clave_emision'] = clave
+        
+        with self.cache.exclusivo(clave):
+            entrada = self.cache.obtener(clave)
+            if entrada:
+                return entrada['ruta']
+            
+            ruta_temporal = self.cache.ruta_objeto(f"{huella}_{entrada_origen['sha256'][:16]}.mp4.tmp")
+            try:
+                # Se recorta a un múltiplo exacto del GOP para que cada vuelta del
+                # bucle empiece en un keyframe y el remux con -c copy no tenga saltos
+                probe = self.verificar_video(entrada_origen['ruta'], entrada_origen['sha256'])
+                gop = PERFIL_EMISION['gop']
+                cuadros = int(duracion_video(probe) * PERFIL_EMISION['fps']) // gop * gop
+                ancho, alto = PERFIL_EMISION['ancho'], PERFIL_EMISION['alto']
+                
+                # El índice de probes decide el camino más barato: copiar si el
+                # origen ya cumple el perfil, omitir scale/pad si ya es 1080p
+                if cumple_perfil_emision(probe):
+                    modo = "copia"
+                    codec = ["-c:v", "copy"]
+                else:
+                    modo = "ligero" if misma_resolucion(probe) else "completo"
+                    filtros = f"setsar=1,fps={PERFIL_EMISION['fps']}"
+                    if modo == "completo":
+                        filtros = (
+                            f"scale={ancho}:{alto}:force_original_aspect_ratio=decrease,"
+                            f"pad={ancho}:{alto}:-1:-1,{filtros}"
+                        )
+                    codec = [
+                        "-vf", filtros,
+                        "-c:v", "libx264",
+                        "-preset", PREENCODIFICAR_PRESET,
+                        "-profile:v", "high",
+                        "-pix_fmt", "yuv420p",
+                        "-x264-params", f"keyint={gop}:min-keyint={gop}:scenecut=0:open-gop=0",
+                        "-b:v", PERFIL_EMISION['video_bitrate'],
+                        "-maxrate", PERFIL_EMISION['video_bitrate'],
+                        "-bufsize", PERFIL_EMISION['bufsize']
+                    ]
+                
+                logging.info(f"🎞️ Pre-codificando video para emisión ({modo}): {video['name']}")
+                inicio = time.monotonic()
+                # nice como prefijo: preexec_fn no es seguro en un proceso con hilos
+                subprocess.run([
+                    "nice", "-n", "10",
+                    "ffmpeg", "-y",
+                    "-loglevel", "error",
+                    "-i", entrada_origen['ruta'],
+                    "-map", "0:v:0",
+                    "-an",
+                    "-frames:v", str(cuadros)
+                ] + codec + [
+                    "-movflags", "+faststart",
+                    "-f", "mp4",
+                    ruta_temporal
+                ], check=True)
+                
+                entrada = self.cache.registrar(clave, ruta_temporal, ".mp4")
+                logging.info(f"✅ Pre-codificación lista en {time.monotonic() - inicio:.1f}s: {video['name']}")
+                return entrada['ruta']
+            except Exception as e:
+                logging.error(f"Error pre-codificando video: {str(e)}")
+                if os.path.exists(ruta_temporal):
+                    os.remove(ruta_temporal)
+                return None
+
+    @trazado("miniatura")
+    def generar_miniatura(self, video):
+        """Elige el cuadro más nítido y mejor expuesto del video y lo cachea como JPEG."""
+        entrada_origen = self.cache.obtener(video['url'])
+        if not entrada_origen:
+            return None
+        
+        clave = f"miniatura:{entrada_origen['sha256']}:{MINIATURA_CANDIDATOS}"
+        entrada = self.cache.obtener(clave)
+        if entrada:
+            return entrada['ruta']
+        
+        directorio = tempfile.mkdtemp(prefix="miniaturas_", dir=self.cache.directorio)
+        try:
+            probe = self.verificar_video(entrada_origen['ruta'], entrada_origen['sha256'])
+            intervalo = probe['duracion'] / (MINIATURA_CANDIDATOS + 1)
+            ancho, alto = MINIATURA_ANALISIS
+            
+            # Una sola decodificación: cada cuadro muestreado sale a la vez en
+            # escala de grises reducida (para puntuar) y como JPEG final
+            result = subprocess.run([
+                "ffmpeg",
+                "-v", "error",
+                "-ss", f"{intervalo / 2:.3f}",
+                "-i", entrada_origen['ruta'],
+                "-filter_complex",
+                f"[0:v]fps=1/{intervalo:.3f},split=2[a][b];"
+                f"[a]scale={ancho}:{alto},format=gray[analisis];"
+                f"[b]scale=1280:720,setsar=1[jpeg]",
+                "-map", "[analisis]", "-frames:v", str(MINIATURA_CANDIDATOS),
+                "-f", "rawvideo", "pipe:1",
+                "-map", "[jpeg]", "-frames:v", str(MINIATURA_CANDIDATOS),
+                "-q:v", "2", os.path.join(directorio, "candidato_%02d.jpg")
+            ], capture_output=True, check=True, timeout=120)
+            
+            tamano = ancho * alto
+            puntuaciones = [
+                puntuar_cuadro(result.stdout[i:i + tamano], ancho, alto)
+                for i in range(0, len(result.stdout) - tamano + 1, tamano)
+            ]
+            if not puntuaciones:
+                raise ValueError("No se extrajeron cuadros candidatos")
+            mejor = max(range(len(puntuaciones)), key=puntuaciones.__getitem__)
+            
+            entrada = self.cache.registrar(
+                clave, os.path.join(directorio, f"candidato_{mejor + 1:02d}.jpg"), ".jpg"
+            )
+            logging.info(f"🖼️ Miniatura elegida: cuadro {mejor + 1}/{len(puntuaciones)} de {video['name']}")
+            return entrada['ruta']
+        except Exception as e:
+            logging.error(f"Error generando miniatura: {str(e)}")
+            return None
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    def elegir_pistas(self, preferidas=None):
+        """Pistas de música para un fondo; las preferidas (p. ej. las precargadas) mandan."""
+        if not MEZCLA_MUSICA or not self.medios.get('musica'):
+            return []
+        pistas = [p for p in (self.buscar('musica', nombre) for nombre in preferidas or []) if p]
+        if pistas:
+            return pistas
+        for _ in range(min(MEZCLA_PISTAS, len(self.medios['musica']))):
+            pista = self.catalogo.elegir(
+                'musica',
+                excluir={p['name'] for p in pistas},
+                elegible=self.disponible
+            )
+            if pista['name'] in {p['name'] for p in pistas}:
+                break
+            pistas.append(pista)
+        return pistas
+
+    @trazado("mezcla")
+    def construir_mezcla(self, audio, pistas):
+        """Renderiza una vez el fondo música + naturaleza y lo deja en caché por conjunto de entradas."""
+        if not pistas:
+            return None
+        # Una pista caída no impide la mezcla: se sigue con las que sí llegaron
+        try:
+            self.descargar_lote([], pistas)
+        except Exception as e:
+            logging.warning(f"Alguna pista de música no se pudo descargar: {str(e)}")
+        pistas = [p for p in pistas if p.get('local_path')]
+        entrada_naturaleza = self.cache.obtener(audio['url'])
+        entradas = [self.cache.obtener(p['url']) for p in pistas]
+        if not pistas or not entrada_naturaleza or not all(entradas):
+            return None
+        
+        parametros = {
+            "naturaleza": entrada_naturaleza['sha256'],
+            "musica": [e['sha256'] for e in entradas],
+            "fundido": MEZCLA_FUNDIDO,
+            "niveles": MEZCLA_NIVELES,
+            "normalizacion": "loudnorm-2p",
+            "audio": self.huella_audio()
+        }
+        huella = huella_parametros(parametros, largo=None)
+        clave = f"mezcla:{huella}"
+        audio['clave_mezcla'] = clave
+        
+        with self.cache.exclusivo(clave):
+            entrada = self.cache.obtener(clave)
+            if entrada:
+                return entrada['ruta']
+            
+            claves_pistas = [p['url'] for p in pistas]
+            self.cache.fijar(claves_pistas)
+            ruta_temporal = self.cache.ruta_objeto(f"{huella[:32]}.m4a.tmp")
+            try:
+                duraciones = [duracion_medio(e['ruta']) for e in entradas]
+                if not all(duraciones):
+                    raise ValueError("Pista de música sin duración")
+                fundido = min([MEZCLA_FUNDIDO] + [d / 2 for d in duraciones])
+                total = sum(duraciones) - fundido * (len(duraciones) - 1)
+                
+                # Las entradas ya están normalizadas a SONORIDAD_OBJETIVO: se aplican los
+                # niveles relativos y se compensa la suma (aproximando señales
+                # incorreladas) para que la segunda pasada de loudnorm pueda ser lineal
+                suma_db = 10 * math.log10(sum(10 ** (nivel / 10) for nivel in MEZCLA_NIVELES.values()))
+                ganancia = {fuente: nivel - suma_db for fuente, nivel in MEZCLA_NIVELES.items()}
+                techo = 10 ** (SONORIDAD_OBJETIVO['TP'] / 20)
+                
+                filtros = []
+                actual = "[1:a]"
+                for i in range(2, len(entradas) + 1):
+                    filtros.append(f"{actual}[{i}:a]acrossfade=d={fundido}:c1=tri:c2=tri[m{i}]")
+                    actual = f"[m{i}]"
+                filtros.append(f"{actual}volume={ganancia['musica']:.2f}dB[musica]")
+                filtros.append(f"[0:a]atrim=duration={total:.3f},volume={ganancia['naturaleza']:.2f}dB[naturaleza]")
+                # amerge + pan suma sin el reescalado que aplica amix en ffmpeg 4.x;
+                # level=disabled evita que alimiter vuelva a subir la señal a 0 dBFS
+                filtros.append(
+                    "[musica][naturaleza]amerge=inputs=2,pan=stereo|c0=c0+c2|c1=c1+c3,"
+                    f"alimiter=limit={techo:.3f}:level=disabled,"
+                    f"afade=t=in:d=0.05,afade=t=out:st={max(total - 0.05, 0):.3f}:d=0.05[mezcla]"
+                )
+                
+                logging.info(f"🎼 Renderizando fondo: {audio['name']} + {len(pistas)} pistas ({total:.0f}s)")
+                inicio = time.monotonic()
+                entradas_cmd = ["-stream_loop", "-1", "-i", entrada_naturaleza['ruta']]
+                for entrada_pista in entradas:
+                    entradas_cmd += ["-i", entrada_pista['ruta']]
+                
+                # La mezcla completa pasa por el mismo loudnorm de dos pasadas que cada audio
+                with obtener_trazador().tramo("sonoridad", medio=clave):
+                    result = subprocess.run(
+                        ["nice", "-n", "10", "ffmpeg", "-hide_banner", "-nostats"] + entradas_cmd + [
+                            "-filter_complex", ";".join(filtros + [f"[mezcla]{filtro_loudnorm()}[fondo]"]),
+                            "-map", "[fondo]",
+                            "-f", "null", "-"
+                        ], capture_output=True, text=True, check=True
+                    )
+                medida = leer_medida_loudnorm(result.stderr)
+                
+                cmd = ["nice", "-n", "10", "ffmpeg", "-y", "-loglevel", "error"] + entradas_cmd + [
+                    "-filter_complex", ";".join(filtros + [f"[mezcla]{filtro_loudnorm(medida)}[fondo]"]),
+                    "-map", "[fondo]",
+                    "-c:a", "aac",
+                    "-b:a", PERFIL_EMISION['audio_bitrate'],
+                    "-ar", str(PERFIL_EMISION['audio_rate']),
+                    "-ac", "2",
+                    "-movflags", "+faststart",
+                    "-f", "mp4",
+                    ruta_temporal
+                ]
+                subprocess.run(cmd, check=True)
+                
+                entrada = self.cache.registrar(
+                    clave, ruta_temporal, ".m4a",
+                    metadatos={
+                        "pistas": [p['name'] for p in pistas],
+                        "naturaleza": audio['name'],
+                        "duracion": total,
+                        "sonoridad": medida
+                    }
+                )
+                logging.info(f"✅ Fondo listo en {time.monotonic() - inicio:.1f}s")
+                return entrada['ruta']
+            except Exception as e:
+                logging.error(f"Error renderizando fondo de audio: {str(e)}")
+                if os.path.exists(ruta_temporal):
+                    os.remove(ruta_temporal)
+                return None
+            finally:
+                self.cache.soltar(claves_pistas)
+
+    def preparar(self, video, audio, pistas=None):
+        """Descarga solo el par elegido (no-op si ya estaba descargado)."""
+        inicio = time.monotonic()
+        self.descargar_lote([video], [audio])
+        entrada = self.cache.obtener(video['url'])
+        video['probe'] = self.probe.consultar(entrada['sha256']) if entrada else None
+        if PREENCODIFICAR and entrada:
+            clave = self.clave_emision(entrada)
+            emision = self.cache.obtener(clave)
+            if emision:
+                video['clave_emision'] = clave
+                video['emision_path'] = emision['ruta']
+            else:
+                # Un pre-encode completo puede durar más que el propio video: se sale
+                # al aire codificando en vivo y la versión de emisión queda para la
+                # próxima vez que se elija este video
+                video['emision_path'] = None
+                threading.Thread(
+                    target=obtener_trazador().propagar(self.preencodificar_video),
+                    args=(dict(video),),
+                    name="preencodificacion",
+                    daemon=True
+                ).start()
+        video['miniatura'] = self.generar_miniatura(video)
+        audio['mezcla_path'] = self.construir_mezcla(audio, self.elegir_pistas(pistas))
+        logging.info(f"✅ Par de medios listo en {time.monotonic() - inicio:.1f}s")
+
+    def precargar_siguiente(self, actual, categorias=None):
+        """Elige el probable siguiente par y lo descarga en segundo plano."""
+        video = self.elegir_video(excluir=actual, categorias=categorias)
+        audio = self.elegir_audio(determinar_categoria(video['name']))
+        pistas = self.elegir_pistas()
+        
+        def _precargar():
+            try:
+                self.descargar_lote([video], [audio])
+                if PREENCODIFICAR:
+                    self.preencodificar_video(video)
+                self.generar_miniatura(video)
+                self.construir_mezcla(audio, pistas)
+                logging.info(f"📦 Siguiente par precargado: {video['name']} + {audio['name']}")
+            except Exception as e:
+                logging.warning(f"No se pudo precargar el siguiente par: {str(e)}")
+        
+        threading.Thread(target=obtener_trazador().propagar(_precargar), daemon=True).start()
+        return {"video": video['name'], "audio": audio['name'], "musica": [p['name'] for p in pistas]}
+
+class CuotaAgotada(Exception):
+    pass
+
+def dia_cuota():
+    try:
+        zona = ZoneInfo("America/Los_Angeles")
+    except Exception:
+        zona = timezone(timedelta(hours=-8))
+    return datetime.now(zona).strftime("%Y-%m-%d")
+
+class LibroCuota:
+    """Contabiliza las unidades de cuota gastadas hoy, compartidas por todos los canales."""
+
+    def __init__(self, ruta=os.path.join(CACHE_DIR, "cuota_youtube.json"), limite=CUOTA_DIARIA, reserva=CUOTA_RESERVA):
+        self.ruta = ruta
+        self.limite = limite
+        self.reserva = reserva
+        self.lock = threading.Lock()
+        try:
+            with open(ruta) as f:
+                self.estado = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.estado = {}
+        self.reiniciar_si_cambio_dia()
+
+    def reiniciar_si_cambio_dia(self):
+        hoy = dia_cuota()
+        if self.estado.get('dia') != hoy:
+            self.estado = {"dia": hoy, "usado": 0, "por_operacion": {}}
+
+    def restante(self):
+        with self.lock:
+            self.reiniciar_si_cambio_dia()
+            return self.limite - self.estado['usado']
+
+    def cargar(self, operacion, esencial=True):
+        """Descuenta el coste de una llamada o lanza CuotaAgotada si no cabe."""
+        coste = COSTES_API.get(operacion, 1)
+        with self.lock:
+            self.reiniciar_si_cambio_dia()
+            restante = self.limite - self.estado['usado']
+            if coste > restante or (not esencial and restante - coste < self.reserva):
+                raise CuotaAgotada(f"{operacion} rechazada: quedan {restante} unidades de cuota")
+            self.estado['usado'] += coste
+            por_operacion = self.estado['por_operacion']
+            por_operacion[operacion] = por_operacion.get(operacion, 0) + coste
+            
+            escribir_json_atomico(self.ruta, self.estado)
+
+_libro_cuota = None
+
+def obtener_cuota():
+    global _libro_cuota
+    with _lock_singletons:
+        if _libro_cuota is None:
+            _libro_cuota = LibroCuota()
+        return _libro_cuota
+
+class CicloVidaBroadcast:
+    """Máquina de estados created → ready → testing → live → complete."""
+
+    TRANSICIONES = {
+        "created": ("ready", "complete"),
+        "ready": ("testing", "complete"),
+        "testing": ("live", "complete"),
+        "live": ("complete",),
+        "complete": ()
+    }
+
+    def __init__(self, broadcast_id, canal=None):
+        self.broadcast_id = broadcast_id
+        self.canal = canal
+        self.estado = "created"
+        self.desde = time.monotonic()
+        self.historial = [("created", datetime.utcnow(), 0.0)]
+
+    def avanzar(self, estado):
+        if estado not in self.TRANSICIONES[self.estado]:
+            raise ValueError(f"Transición inválida {self.estado} → {estado}")
+        ahora = time.monotonic()
+        latencia = ahora - self.desde
+        logging.info(f"🔀 Broadcast {self.broadcast_id}: {self.estado} → {estado} ({latencia:.1f}s)")
+        if self.canal:
+            self.canal.registrar_fase(f"{self.estado}_a_{estado}", latencia)
+        self.estado = estado
+        self.desde = ahora
+        self.historial.append((estado, datetime.utcnow(), latencia))
+
 class YouTubeManager:
-    def __init__(self):
-        self.youtube = self.autenticar()
+    def __init__(self, nombre_ingesta="principal", servicio=None):
+        # Cada canal reutiliza su propio stream de ingesta (y su clave RTMP)
+        self.nombre_ingesta = nombre_ingesta
+        self.ruta_estado = os.path.join(CACHE_DIR, f"youtube_{nombre_ingesta}.json")
+        self.creds = None
+        self.lock = threading.RLock()
+        self.consultas = {}
+        self.cuota = obtener_cuota()
+        self.youtube = servicio or self.autenticar()
+        if self.creds:
+            threading.Thread(
+                target=self.renovar_token,
+                name=f"token-{nombre_ingesta}",
+                daemon=True
+            ).start()
     
     def autenticar(self):
         try:
@@ -181,35 +1696,97 @@ class YouTubeManager:
                 scopes=['https://www.googleapis.com/auth/youtube']
             )
             creds.refresh(Request())
+            self.creds = creds
             return build('youtube', 'v3', credentials=creds)
         except Exception as e:
             logging.error(f"Error autenticación YouTube: {str(e)}")
             return None
-    
-    def generar_miniatura(self, video_path):
+
+    def renovar_token(self):
+        """Renueva el token antes de que expire para que ninguna llamada pague el refresh."""
+        while True:
+            espera = 0
+            if self.creds.expiry:
+                espera = (self.creds.expiry - datetime.utcnow()).total_seconds() - TOKEN_MARGEN_SEGUNDOS
+            time.sleep(max(espera, 30))
+            try:
+                with self.lock:
+                    self.creds.refresh(Request())
+                logging.info(f"🔑 Token de YouTube renovado, expira {self.creds.expiry:%H:%M} UTC")
+            except Exception as e:
+                logging.warning(f"No se pudo renovar el token de YouTube: {str(e)}")
+
+    def ejecutar(self, peticion):
+        # httplib2 no es seguro entre hilos y el canal prepara el siguiente
+        # broadcast mientras el actual sigue emitiendo
+        with self.lock:
+            with obtener_trazador().tramo("api", metodo=getattr(peticion, 'methodId', None) or "lote"):
+                return peticion.execute()
+
+    def consulta_cacheada(self, clave):
+        guardado = self.consultas.get(clave)
+        if guardado and time.monotonic() - guardado[0] < CONSULTAS_TTL_SEGUNDOS:
+            return guardado[1]
+        return None
+
+    def guardar_consulta(self, clave, valor):
+        self.consultas[clave] = (time.monotonic(), valor)
+
+    def cargar_estado(self):
         try:
-            output_path = "/tmp/miniatura_nueva.jpg"
-            
-            subprocess.run([
-                "ffmpeg",
-                "-y", "-ss", "00:00:10",
-                "-i", video_path,
-                "-vframes", "1",
-                "-q:v", "2",
-                "-vf", "scale=1280:720,setsar=1",
-                output_path
-            ], check=True, timeout=30)
-            
-            return output_path
-        except Exception as e:
-            logging.error(f"Error generando miniatura: {str(e)}")
+            with open(self.ruta_estado) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def guardar_estado(self, estado):
+        escribir_json_atomico(self.ruta_estado, estado)
+
+    def peticion_nuevo_stream(self):
+        return self.youtube.liveStreams().insert(
+            part="snippet,cdn,contentDetails",
+            body={
+                "snippet": {
+                    "title": f"Stream de ingesta {self.nombre_ingesta}"
+                },
+                "cdn": {
+                    "format": "1080p",
+                    "ingestionType": "rtmp",
+                    "resolution": "1080p",
+                    "frameRate": "30fps"
+                },
+                "contentDetails": {
+                    "isReusable": True
+                }
+            }
+        )
+
+    def copiar_miniatura(self, miniatura):
+        """Copia la miniatura cacheada a una ruta única para este broadcast."""
+        if not miniatura or not os.path.exists(miniatura):
             return "default_thumbnail.jpg"
+        descriptor, ruta = tempfile.mkstemp(prefix=f"miniatura_{self.nombre_ingesta}_", suffix=".jpg")
+        os.close(descriptor)
+        shutil.copyfile(miniatura, ruta)
+        return ruta
     
-    def crear_transmision(self, titulo, video_path):
+    def crear_transmision(self, titulo, miniatura, inicio=None):
+        """Crea el broadcast; con inicio se programa como relevo del que está al aire."""
         try:
-            scheduled_start = datetime.utcnow() + timedelta(minutes=5)
+            scheduled_start = inicio or datetime.utcnow() + timedelta(minutes=5)
+            
+            # El broadcast nuevo y el stream de ingesta persistente no dependen
+            # entre sí: viajan en una sola petición por lotes
+            resultados = {}
             
-            broadcast = self.youtube.liveBroadcasts().insert(
+            def recoger(nombre):
+                def callback(request_id, response, exception):
+                    resultados[nombre] = (response, exception)
+                return callback
+            
+            lote = self.youtube.new_batch_http_request()
+            self.cuota.cargar("liveBroadcasts.insert")
+            lote.add(self.youtube.liveBroadcasts().insert(
                 part="snippet,status",
                 body={
                   "snippet": {
@@ -220,49 +1797,75 @@ class YouTubeManager:
                     "status": {
                         "privacyStatus": "public",
                         "selfDeclaredMadeForKids": False,
-                        "enableAutoStart": True,
+                        # Un relevo comparte stream de ingesta con el broadcast en
+                        # curso: el autoarranque lo pondría al aire antes de tiempo
+                        "enableAutoStart": inicio is None,
                         "enableAutoStop": True,
                         "enableArchive": True,
                         "lifeCycleStatus": "created"
                     }
                 }
-            ).execute()
+            ), callback=recoger('broadcast'))
             
-            stream = self.youtube.liveStreams().insert(
-                part="snippet,cdn",
-                body={
-                    "snippet": {
-                        "title": "Stream de ingesta principal"
-                    },
-                    "cdn": {
-                        "format": "1080p",
-                        "ingestionType": "rtmp",
-                        "resolution": "1080p",
-                        "frameRate": "30fps"
-                    }
-                }
-            ).execute()
+            stream_id = self.cargar_estado().get('stream_id')
+            stream = self.consulta_cacheada(f"stream:{stream_id}") if stream_id else None
+            if not stream and stream_id:
+                self.cuota.cargar("liveStreams.list")
+                lote.add(self.youtube.liveStreams().list(
+                    part="id,snippet,cdn,status",
+                    id=stream_id
+                ), callback=recoger('stream_existente'))
+            elif not stream:
+                self.cuota.cargar("liveStreams.insert")
+                lote.add(self.peticion_nuevo_stream(), callback=recoger('stream_nuevo'))
+            self.ejecutar(lote)
+            
+            broadcast, error = resultados['broadcast']
+            if error:
+                raise error
+            
+            if 'stream_existente' in resultados:
+                respuesta, error = resultados['stream_existente']
+                if error:
+                    raise error
+                stream = respuesta['items'][0] if respuesta.get('items') else None
+                if not stream:
+                    logging.warning("Stream de ingesta persistente no encontrado, se crea uno nuevo")
+                    self.cuota.cargar("liveStreams.insert")
+                    stream = self.ejecutar(self.peticion_nuevo_stream())
+            elif 'stream_nuevo' in resultados:
+                stream, error = resultados['stream_nuevo']
+                if error:
+                    raise error
             
-            self.youtube.liveBroadcasts().bind(
+            if stream['id'] != stream_id:
+                self.guardar_estado({"stream_id": stream['id']})
+                logging.info(f"🔗 Stream de ingesta persistente: {stream['id']}")
+            self.guardar_consulta(f"stream:{stream['id']}", stream)
+            
+            self.cuota.cargar("liveBroadcasts.bind")
+            self.ejecutar(self.youtube.liveBroadcasts().bind(
                 part="id,contentDetails",
                 id=broadcast['id'],
                 streamId=stream['id']
-            ).execute()
+            ))
             
             rtmp_url = stream['cdn']['ingestionInfo']['ingestionAddress']
+            rtmp_respaldo = stream['cdn']['ingestionInfo'].get('backupIngestionAddress')
             stream_name = stream['cdn']['ingestionInfo']['streamName']
             
-            thumbnail_path = self.generar_miniatura(video_path)
+            thumbnail_path = self.copiar_miniatura(miniatura)
             if thumbnail_path and os.path.exists(thumbnail_path):
-                self.youtube.thumbnails().set(
-                    videoId=broadcast['id'],
-                    media_body=thumbnail_path
-                ).execute()
-                if thumbnail_path != "default_thumbnail.jpg":
-                    os.remove(thumbnail_path)
+                # La miniatura no bloquea la salida al aire: se sube en paralelo
+                threading.Thread(
+                    target=obtener_trazador().propagar(self.subir_miniatura),
+                    args=(broadcast['id'], thumbnail_path),
+                    daemon=True
+                ).start()
             
             return {
                 "rtmp": f"{rtmp_url}/{stream_name}",
+                "rtmp_respaldo": f"{rtmp_respaldo}/{stream_name}" if rtmp_respaldo else None,
                 "scheduled_start": scheduled_start,
                 "broadcast_id": broadcast['id'],
                 "stream_id": stream['id']
@@ -271,12 +1874,29 @@ class YouTubeManager:
             logging.error(f"Error creando transmisión: {str(e)}")
             return None
     
+    @trazado("subida_miniatura")
+    def subir_miniatura(self, broadcast_id, thumbnail_path):
+        try:
+            # httplib2 no es seguro entre hilos: la subida usa su propia conexión
+            http = AuthorizedHttp(self.creds, http=httplib2.Http()) if self.creds else None
+            self.cuota.cargar("thumbnails.set", esencial=False)
+            self.youtube.thumbnails().set(
+                videoId=broadcast_id,
+                media_body=thumbnail_path
+            ).execute(http=http)
+        except Exception as e:
+            logging.error(f"Error subiendo miniatura: {str(e)}")
+        finally:
+            if thumbnail_path != "default_thumbnail.jpg" and os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+    
     def obtener_estado_stream(self, stream_id):
         try:
-            response = self.youtube.liveStreams().list(
+            self.cuota.cargar("liveStreams.list")
+            response = self.ejecutar(self.youtube.liveStreams().list(
                 part="status",
                 id=stream_id
-            ).execute()
+            ))
             if response.get('items'):
                 return response['items'][0]['status']['streamStatus']
             return None
@@ -284,54 +1904,228 @@ class YouTubeManager:
             logging.error(f"Error obteniendo estado del stream: {str(e)}")
             return None
     
+    def esperar_stream_activo(self, stream_id, limite=ESPERA_ACTIVO_SEGUNDOS):
+        """Sondea el estado de ingesta: rápido al principio y cada vez más espaciado."""
+        intervalo = 1.0
+        fin = time.monotonic() + limite
+        while time.monotonic() < fin:
+            if self.obtener_estado_stream(stream_id) == 'active':
+                return True
+            time.sleep(max(min(intervalo, fin - time.monotonic()), 0))
+            intervalo = min(intervalo * 1.5, 15)
+        return False
+    
+    def obtener_estado_broadcast(self, broadcast_id):
+        try:
+            self.cuota.cargar("liveBroadcasts.list")
+            response = self.ejecutar(self.youtube.liveBroadcasts().list(
+                part="status",
+                id=broadcast_id
+            ))
+            if response.get('items'):
+                return response['items'][0]['status']['lifeCycleStatus']
+            return None
+        except Exception as e:
+            logging.error(f"Error obteniendo estado del broadcast: {str(e)}")
+            return None
+
+    def esperar_estado_broadcast(self, broadcast_id, estado, limite=ESPERA_ESTADO_SEGUNDOS):
+        """Sondea lifeCycleStatus hasta ver `estado`; las transiciones de YouTube son asíncronas."""
+        intervalo = 1.0
+        fin = time.monotonic() + limite
+        while time.monotonic() < fin:
+            observado = self.obtener_estado_broadcast(broadcast_id)
+            if observado == estado:
+                return True
+            logging.info(f"⏳ Broadcast en {observado}, esperando {estado}...")
+            time.sleep(max(min(intervalo, fin - time.monotonic()), 0))
+            intervalo = min(intervalo * 1.5, 15)
+        return False
+
     def transicionar_estado(self, broadcast_id, estado):
         try:
-            self.youtube.liveBroadcasts().transition(
+            self.cuota.cargar("liveBroadcasts.transition")
+            self.ejecutar(self.youtube.liveBroadcasts().transition(
                 broadcastStatus=estado,
                 id=broadcast_id,
                 part="id,status"
-            ).execute()
+            ))
             return True
         except Exception as e:
             logging.error(f"Error transicionando a {estado}: {str(e)}")
             return False
 
+    def eliminar_transmision(self, broadcast_id):
+        try:
+            self.cuota.cargar("liveBroadcasts.delete")
+            self.ejecutar(self.youtube.liveBroadcasts().delete(id=broadcast_id))
+            return True
+        except Exception as e:
+            logging.error(f"Error eliminando transmisión: {str(e)}")
+            return False
+
     def finalizar_transmision(self, broadcast_id):
         try:
-            self.youtube.liveBroadcasts().transition(
+            self.cuota.cargar("liveBroadcasts.transition")
+            self.ejecutar(self.youtube.liveBroadcasts().transition(
                 broadcastStatus="complete",
                 id=broadcast_id,
                 part="id,status"
-            ).execute()
+            ))
             return True
         except Exception as e:
             logging.error(f"Error finalizando transmisión: {str(e)}")
             return False
 
+def normalizar_texto(texto):
+    """Minúsculas sin tildes: 'LLuvia Cañón' -> 'lluvia canon'."""
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+def tokenizar(texto):
+    return re.findall(r"[a-z0-9]+", normalizar_texto(texto))
+
+PALABRA_A_CATEGORIA = {
+    normalizar_texto(palabra): categoria
+    for categoria, palabras in PALABRAS_CLAVE.items()
+    for palabra in palabras
+}
+
+def categoria_de(nombre):
+    """Categoría con más palabras clave en el nombre, o None si no hay ninguna."""
+    contador = {}
+    for token in tokenizar(nombre):
+        categoria = PALABRA_A_CATEGORIA.get(token)
+        if categoria:
+            contador[categoria] = contador.get(categoria, 0) + 1
+    return max(contador, key=contador.get) if contador else None
+
+def categorias_de(nombre):
+    """Todas las categorías con alguna palabra clave en el nombre: 'Lluvia Bosque' -> {lluvia, bosque}."""
+    return {PALABRA_A_CATEGORIA[t] for t in tokenizar(nombre) if t in PALABRA_A_CATEGORIA}
+
 def determinar_categoria(nombre_video):
-    nombre = nombre_video.lower()
-    contador = {categoria: 0 for categoria in PALABRAS_CLAVE}
-    
-    for palabra in nombre.split():
-        for categoria, palabras in PALABRAS_CLAVE.items():
-            if palabra in palabras:
-                contador[categoria] += 1
-                
-    max_categoria = max(contador, key=contador.get)
-    return max_categoria if contador[max_categoria] > 0 else random.choice(list(PALABRAS_CLAVE.keys()))
+    return categoria_de(nombre_video) or random.choice(list(PALABRAS_CLAVE.keys()))
+
+class BolsaPonderada:
+    """Elección aleatoria ponderada en O(log n) sobre pesos acumulados."""
+
+    def __init__(self):
+        self.medios = []
+        self.acumulados = []
+        self.total = 0.0
+
+    def agregar(self, medio):
+        self.total += max(float(medio.get('peso', 1)), 0.0)
+        self.medios.append(medio)
+        self.acumulados.append(self.total)
+
+    def elegir(self):
+        indice = bisect.bisect_right(self.acumulados, random.random() * self.total)
+        return self.medios[min(indice, len(self.medios) - 1)]
+
+_historial_elecciones = {}
+_lock_historial = threading.Lock()
+
+class IndiceCatalogo:
+    """Índice invertido categoría -> medios, construido una vez por carga de manifiesto."""
+
+    INTENTOS = 16
+
+    def __init__(self, medios, ventana=HISTORIAL_SIN_REPETIR):
+        self.ventana = ventana
+        self.por_nombre = {}
+        self.categorias = {}
+        self.bolsas = {}
+        for tipo, lista in medios.items():
+            if not isinstance(lista, list):
+                continue
+            self.por_nombre[tipo] = {}
+            self.bolsas[tipo] = {None: BolsaPonderada()}
+            for medio in lista:
+                # Un medio entra en todas las categorías que nombra, no solo en la principal
+                categorias = categorias_de(medio['name'])
+                self.por_nombre[tipo][medio['name']] = medio
+                self.categorias[medio['name']] = categorias
+                self.bolsas[tipo][None].agregar(medio)
+                for categoria in categorias:
+                    self.bolsas[tipo].setdefault(categoria, BolsaPonderada()).agregar(medio)
+
+    def buscar(self, tipo, nombre):
+        return self.por_nombre.get(tipo, {}).get(nombre)
+
+    def categorias_de(self, nombre):
+        return self.categorias.get(nombre, set())
+
+    def seleccionables(self, tipo, categorias=None):
+        """Categorías cuyas bolsas muestrea elegir(); [None] es el catálogo completo."""
+        bolsas_tipo = self.bolsas.get(tipo) or {}
+        return [c for c in (categorias or [None]) if c in bolsas_tipo and bolsas_tipo[c].medios] or [None]
+
+    def historial(self, tipo):
+        with _lock_historial:
+            if tipo not in _historial_elecciones:
+                _historial_elecciones[tipo] = deque(maxlen=max(self.ventana, 1))
+            return _historial_elecciones[tipo]
+
+    def recientes(self, tipo):
+        historial = self.historial(tipo)
+        with _lock_historial:
+            return set(historial) if self.ventana > 0 else set()
+
+    def registrar_eleccion(self, tipo, medio):
+        historial = self.historial(tipo)
+        with _lock_historial:
+            historial.append(medio['name'])
+
+    def elegir(self, tipo, categorias=None, excluir=(), elegible=None):
+        """Elige un medio ponderado por 'peso' evitando los últimos elegidos.
+
+        Primero muestrea las bolsas de las categorías pedidas y descarta
+        repetidos; solo si todos los intentos fallan recurre a un filtrado
+        lineal que va relajando la ventana y las categorías.
+        """
+        bolsas_tipo = self.bolsas.get(tipo) or {None: BolsaPonderada()}
+        bolsas = [bolsas_tipo[c] for c in self.seleccionables(tipo, categorias)]
+        if not bolsas[0].medios:
+            raise ValueError(f"Catálogo vacío: {tipo}")
+        
+        recientes = self.recientes(tipo)
+        
+        def valido(medio, evitar):
+            return medio['name'] not in evitar and (elegible is None or elegible(medio))
+        
+        evitar = recientes | set(excluir)
+        for _ in range(self.INTENTOS):
+            bolsa = bolsas[0] if len(bolsas) == 1 else random.choices(bolsas, weights=[b.total for b in bolsas])[0]
+            medio = bolsa.elegir()
+            if valido(medio, evitar):
+                self.registrar_eleccion(tipo, medio)
+                return medio
+        
+        # Ventana mayor que el catálogo (o casi todo excluido): relajar restricciones
+        for grupo, evitar in (
+            (bolsas, recientes | set(excluir)),
+            (bolsas, set(excluir)),
+            ([bolsas_tipo[None]], set(excluir)),
+            ([bolsas_tipo[None]], set())
+        ):
+            # Un medio con varias categorías pedidas aparece en varias bolsas: una sola vez
+            candidatos = list({m['name']: m for b in grupo for m in b.medios if valido(m, evitar)}.values())
+            if candidatos:
+                medio = random.choices(candidatos, weights=[max(float(m.get('peso', 1)), 0.0) or 1e-9 for m in candidatos])[0]
+                self.registrar_eleccion(tipo, medio)
+                return medio
+        
+        medio = bolsas_tipo[None].elegir()
+        self.registrar_eleccion(tipo, medio)
+        return medio
 
 def seleccionar_audio_compatible(gestor, categoria_video):
-    audios_compatibles = [
-        audio for audio in gestor.medios['sonidos_naturaleza']
-        if audio['local_path'] and 
-        any(palabra in audio['name'].lower() 
-        for palabra in PALABRAS_CLAVE[categoria_video])
-    ]
-    
-    if not audios_compatibles:
-        audios_compatibles = [a for a in gestor.medios['sonidos_naturaleza'] if a['local_path']]
-    
-    return random.choice(audios_compatibles)
+    return gestor.catalogo.elegir(
+        'sonidos_naturaleza', [categoria_video],
+        elegible=gestor.disponible
+    )
 
 def generar_titulo(nombre_video, categoria):
     ubicaciones = {
@@ -380,162 +2174,993 @@ def generar_titulo(nombre_video, categoria):
     
     return random.choice(plantillas)
 
-def manejar_transmision(stream_data, youtube):
+def duracion_medio(path):
+    result = subprocess.run([
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ], capture_output=True, text=True, timeout=30)
+    return float(result.stdout) if result.stdout.strip() else None
+
+PERFIL_ENCODER_DEFECTO = {"preset": "ultrafast", "hilos": 1, "nucleos": None}
+_perfil_encoder = None
+
+def obtener_perfil_encoder():
+    return _perfil_encoder or PERFIL_ENCODER_DEFECTO
+
+def huella_host(canales_previstos):
+    """Identifica host + ffmpeg + parámetros: si algo cambia, se recalibra."""
     try:
-        tiempo_inicio_ffmpeg = stream_data['start_time'] - timedelta(minutes=1)
-        espera_ffmpeg = (tiempo_inicio_ffmpeg - datetime.utcnow()).total_seconds()
-        
-        if espera_ffmpeg > 0:
-            logging.info(f"⏳ Esperando {espera_ffmpeg:.0f} segundos para iniciar FFmpeg...")
-            time.sleep(espera_ffmpeg)
-        
-        cmd = [
-            "ffmpeg",
+        with open("/proc/cpuinfo") as f:
+            modelo = next((l.split(":", 1)[1].strip() for l in f if l.startswith("model name")), "")
+    except OSError:
+        modelo = ""
+    try:
+        version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, timeout=10).stdout.split("\n")[0]
+    except Exception:
+        version = ""
+    datos = {
+        "cpu": modelo,
+        "nucleos": os.cpu_count(),
+        "presupuesto": PRESUPUESTO_CPU,
+        "ffmpeg": version,
+        "perfil": PERFIL_EMISION,
+        "presets": CALIBRACION_PRESETS,
+        "hilos": CALIBRACION_HILOS,
+        "canales": canales_previstos,
+        "margen": MARGEN_TIEMPO_REAL
+    }
+    return huella_parametros(datos)
+
+def medir_encoder(clip, preset, hilos):
+    """Codifica el clip sin -re; devuelve (velocidad x tiempo real, núcleos por canal en tiempo real)."""
+    perfil = PERFIL_EMISION
+    inicio = time.monotonic()
+    proceso = subprocess.Popen([
+        "ffmpeg", "-y",
+        "-loglevel", "error",
+        "-i", clip,
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-tune", "zerolatency",
+        "-x264-params", f"keyint={perfil['gop']}:min-keyint={perfil['gop']}",
+        "-b:v", perfil['video_bitrate'],
+        "-maxrate", perfil['video_bitrate'],
+        "-bufsize", perfil['bufsize'],
+        "-threads", str(hilos),
+        "-f", "null", "-"
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, estado, uso = os.wait4(proceso.pid, 0)
+    proceso.returncode = os.waitstatus_to_exitcode(estado)
+    if proceso.returncode != 0:
+        raise RuntimeError(f"ffmpeg terminó con código {proceso.returncode}")
+    segundos = time.monotonic() - inicio
+    # CPU por segundo de medio = núcleos que ocupa un canal emitiendo a tiempo real
+    return CALIBRACION_SEGUNDOS / segundos, (uso.ru_utime + uso.ru_stime) / CALIBRACION_SEGUNDOS
+
+def calibrar_encoder(canales_previstos=1, forzar=False):
+    """Elige el preset/hilos de mayor calidad que el host sostiene con margen para todos los canales.
+
+    El resultado se guarda por huella de host, así los siguientes arranques no recalibran.
+    """
+    global _perfil_encoder
+    ruta = os.path.join(CACHE_DIR, "calibracion_encoder.json")
+    huella = huella_host(canales_previstos)
+    try:
+        with open(ruta) as f:
+            guardadas = json.load(f)
+    except (OSError, ValueError):
+        guardadas = {}
+    if huella in guardadas and not forzar:
+        _perfil_encoder = guardadas[huella]
+        logging.info(
+            f"🎛️ Perfil de encoder calibrado (caché): {_perfil_encoder['preset']}, "
+            f"{_perfil_encoder['hilos']} hilos, {_perfil_encoder['nucleos']:.2f} núcleos/canal"
+        )
+        return _perfil_encoder
+    
+    perfil = PERFIL_EMISION
+    hilos_posibles = [h for h in CALIBRACION_HILOS if h <= (os.cpu_count() or 1)] or [1]
+    directorio = tempfile.mkdtemp(prefix="calibracion_", dir=CACHE_DIR)
+    clip = os.path.join(directorio, "clip.mp4")
+    elegido = None
+    mediciones = []
+    try:
+        logging.info(f"🎛️ Calibrando encoder para {canales_previstos} canal(es)...")
+        # Ruido temporal sobre testsrc2: se parece más a lluvia o fuego que un patrón estático
+        subprocess.run([
+            "ffmpeg", "-y",
             "-loglevel", "error",
-            "-rtbufsize", "100M",
-            "-re",
-            "-stream_loop", "-1",
-            "-i", stream_data['video']['local_path'],
-            "-stream_loop", "-1",
-            "-i", stream_data['audio']['local_path'],
-            "-map", "0:v:0",
-            "-map", "1:a:0",
-            "-vf", "scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:-1:-1,setsar=1",
+            "-f", "lavfi",
+            "-i", f"testsrc2=size={perfil['ancho']}x{perfil['alto']}:rate={perfil['fps']}:duration={CALIBRACION_SEGUNDOS},"
+                  f"noise=alls=12:allf=t+u",
             "-c:v", "libx264",
             "-preset", "ultrafast",
+            "-crf", "12",
+            "-pix_fmt", "yuv420p",
+            clip
+        ], check=True)
+        
+        limite = time.monotonic() + CALIBRACION_MAX_SEGUNDOS
+        for preset in CALIBRACION_PRESETS:
+            viable = None
+            for hilos in hilos_posibles:
+                if time.monotonic() > limite:
+                    break
+                velocidad, nucleos = medir_encoder(clip, preset, hilos)
+                mediciones.append({"preset": preset, "hilos": hilos, "velocidad": velocidad, "nucleos": nucleos})
+                sostenible = (
+                    velocidad >= MARGEN_TIEMPO_REAL
+                    and canales_previstos * nucleos * MARGEN_TIEMPO_REAL <= PRESUPUESTO_CPU
+                )
+                logging.info(
+                    f"🎛️ {preset:<10} {hilos} hilos: {velocidad:5.2f}x, {nucleos:4.2f} núcleos"
+                    f"{' ✅' if sostenible else ''}"
+                )
+                if sostenible:
+                    # Con menos hilos basta: más hilos solo añaden sobrecoste
+                    viable = {"preset": preset, "hilos": hilos, "velocidad": velocidad, "nucleos": nucleos}
+                    break
+            if not viable:
+                # Los presets siguientes son más lentos: tampoco llegarían
+                break
+            elegido = viable
+    except Exception as e:
+        logging.error(f"Error calibrando encoder: {str(e)}")
+        return obtener_perfil_encoder()
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    
+    if not elegido:
+        # Ni el más rápido llega con margen: se usa igualmente y el supervisor aplazará canales
+        base = mediciones[0] if mediciones else {}
+        elegido = dict(PERFIL_ENCODER_DEFECTO, **{k: base[k] for k in ("velocidad", "nucleos") if k in base})
+        logging.warning("⚠️ El host no sostiene ni el preset más rápido con el margen pedido")
+    
+    elegido.update({"huella": huella, "canales": canales_previstos, "medido": time.time()})
+    guardadas[huella] = elegido
+    escribir_json_atomico(ruta, guardadas, indent=1)
+    _perfil_encoder = elegido
+    logging.info(f"🎛️ Perfil de encoder elegido: {elegido['preset']}, {elegido['hilos']} hilos")
+    return elegido
+
+def escapar_tee(texto):
+    return re.sub(r"([\\|\[\]])", r"\\\1", texto)
+
+def destinos_salida(stream_data):
+    """Esclavos del muxer tee: el principal aborta el encoder si cae, el resto se ignora."""
+    # onfail=abort explícito: según la versión de ffmpeg el valor por defecto es seguir
+    destinos = [f"[f=flv:onfail=abort]{escapar_tee(stream_data['rtmp'])}"]
+    respaldo = stream_data.get('rtmp_respaldo')
+    # Con ENCODER_RESPALDO la ingesta secundaria ya tiene su propio encoder
+    if respaldo and INGESTA_RESPALDO and not ENCODER_RESPALDO:
+        destinos.append(f"[f=flv:onfail=ignore]{escapar_tee(respaldo)}")
+    for url in stream_data.get('salidas_extra') or []:
+        destinos.append(f"[f=flv:onfail=ignore]{escapar_tee(url)}")
+    grabacion = stream_data.get('grabacion')
+    if grabacion:
+        os.makedirs(grabacion, exist_ok=True)
+        # segment_wrap reutiliza los nombres: solo quedan los últimos N segmentos
+        patron = os.path.join(grabacion, f"{stream_data.get('canal', 'principal')}_%03d.ts")
+        destinos.append(
+            f"[f=segment:segment_format=mpegts:segment_time={GRABACION_SEGMENTO_SEG}"
+            f":segment_wrap={GRABACION_SEGMENTOS}:reset_timestamps=1:onfail=ignore]{escapar_tee(patron)}"
+        )
+    return destinos
+
+def construir_comando_ffmpeg(stream_data, posicion=0.0, destino=None):
+    """Comando del encoder en vivo; posicion (s) retoma los bucles tras un reinicio."""
+    video = stream_data['video']
+    perfil = PERFIL_EMISION
+    cmd = [
+        "ffmpeg",
+        "-loglevel", "error",
+        "-progress", "pipe:1",
+        "-nostats",
+        "-rtbufsize", "100M",
+        "-re"
+    ]
+    
+    # -ss de entrada solo afecta a la primera vuelta; -stream_loop vuelve al inicio del archivo
+    for ruta, duracion in (
+        (video.get('emision_path') or video['local_path'], stream_data.get('duracion_video')),
+        (stream_data['audio'].get('mezcla_path') or stream_data['audio']['local_path'], stream_data.get('duracion_audio'))
+    ):
+        cmd += ["-stream_loop", "-1"]
+        if posicion and duracion:
+            cmd += ["-ss", f"{posicion % duracion:.3f}"]
+        cmd += ["-i", ruta]
+    
+    cmd += [
+        "-map", "0:v:0",
+        "-map", "1:a:0"
+    ]
+    
+    if video.get('emision_path') or cumple_perfil_emision(video.get('probe')):
+        # Video pre-codificado en ingesta (o que ya cumple el perfil): solo remux
+        cmd += ["-c:v", "copy"]
+    else:
+        filtros = "setsar=1"
+        if not misma_resolucion(video.get('probe')):
+            filtros = (
+                f"scale={perfil['ancho']}:{perfil['alto']}:force_original_aspect_ratio=decrease,"
+                f"pad={perfil['ancho']}:{perfil['alto']}:-1:-1,{filtros}"
+            )
+        encoder = obtener_perfil_encoder()
+        cmd += [
+            "-vf", filtros,
+            "-c:v", "libx264",
+            "-preset", encoder['preset'],
             "-tune", "zerolatency",
-            "-x264-params", "keyint=48:min-keyint=48",
-            "-b:v", "3000k",
-            "-maxrate", "3000k",
-            "-bufsize", "6000k",
-            "-r", "24",
-            "-g", "48",
-            "-threads", "1",
-            "-flush_packets", "1",
+            "-x264-params", f"keyint={perfil['gop']}:min-keyint={perfil['gop']}",
+            "-b:v", perfil['video_bitrate'],
+            "-maxrate", perfil['video_bitrate'],
+            "-bufsize", perfil['bufsize'],
+            "-r", str(perfil['fps']),
+            "-g", str(perfil['gop']),
+            "-threads", str(encoder['hilos'])
+        ]
+    
+    cmd += ["-flush_packets", "1"]
+    
+    if (stream_data['audio'].get('mezcla_path') or stream_data['audio']['local_path']).endswith(".m4a"):
+        # AAC pre-codificado y normalizado en la caché: solo remux
+        cmd += ["-c:a", "copy"]
+    else:
+        cmd += [
             "-c:a", "aac",
-            "-b:a", "96k",
-            "-ar", "44100",
-            "-f", "flv",
-            stream_data['rtmp']
+            "-b:a", perfil['audio_bitrate'],
+            "-ar", str(perfil['audio_rate'])
+        ]
+    
+    destinos = destinos_salida(stream_data) if SALIDA_TEE and not destino else []
+    if len(destinos) > 1:
+        # Con tee el encoder no sabe qué exige cada salida: cabeceras globales para
+        # todas y etiquetas FLV explícitas (al copiar, la avc1 del mp4 no vale en FLV)
+        cmd += [
+            "-flags", "+global_header",
+            "-tag:v", "7",
+            "-tag:a", "10",
+            "-f", "tee",
+            "|".join(destinos)
         ]
+    else:
+        cmd += ["-f", "flv", destino or stream_data['rtmp']]
+    return cmd
+
+def tiempo_cpu_proceso(pid):
+    """Segundos de CPU (usuario + sistema) consumidos por un proceso, vía /proc."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            campos = f.read().rpartition(")")[2].split()
+        return (int(campos[11]) + int(campos[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+def interpretar_progreso(bloque):
+    def numero(valor, sufijo=""):
+        try:
+            return float(valor.replace(sufijo, "")) if valor and valor != "N/A" else None
+        except ValueError:
+            return None
+    
+    out_time_us = numero(bloque.get('out_time_us') or bloque.get('out_time_ms'))
+    return {
+        "frame": numero(bloque.get('frame')),
+        "fps": numero(bloque.get('fps')),
+        "bitrate_kbps": numero(bloque.get('bitrate'), "kbits/s"),
+        "total_size": numero(bloque.get('total_size')),
+        "out_time": out_time_us / 1e6 if out_time_us is not None else None,
+        "dup_frames": numero(bloque.get('dup_frames')),
+        "drop_frames": numero(bloque.get('drop_frames')),
+        "speed": numero(bloque.get('speed'), "x")
+    }
+
+def detener_proceso(proceso):
+    if proceso and proceso.poll() is None:
+        try:
+            os.killpg(proceso.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        proceso.wait()
+
+class ControlReinicios:
+    """Backoff de relanzamiento de un encoder: inmediato, exponencial con jitter y cortacircuitos."""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.reinicios = deque(maxlen=MAX_REINICIOS_VENTANA)
+        self.fallos_consecutivos = 0
+
+    def espera(self, inicio_encoder):
+        """Segundos a esperar antes de relanzar el encoder caído."""
+        ahora = time.monotonic()
+        if inicio_encoder and time.time() - inicio_encoder > REINICIO_ESTABLE:
+            self.fallos_consecutivos = 0
+        self.fallos_consecutivos += 1
         
-        proceso = subprocess.Popen(cmd)
-        logging.info("🟢 FFmpeg iniciado - Estableciendo conexión RTMP...")
+        if len(self.reinicios) == self.reinicios.maxlen and ahora - self.reinicios[0] < 300:
+            logging.error(
+                f"🧯 Bucle de caídas en {self.nombre}: "
+                f"{len(self.reinicios)} reinicios en 5 min, enfriando {REINICIO_ENFRIAMIENTO}s"
+            )
+            self.reinicios.clear()
+            return REINICIO_ENFRIAMIENTO
+        if self.fallos_consecutivos == 1:
+            return 0
+        tope = min(REINICIO_BASE * 2 ** (self.fallos_consecutivos - 2), REINICIO_MAX)
+        return random.uniform(tope / 2, tope)
+
+    def registrar(self):
+        self.reinicios.append(time.monotonic())
+
+class Canal:
+    """Un canal 24/7 con su propia programación, selección de medios y ffmpeg."""
+
+    def __init__(self, config):
+        self.nombre = config.get('nombre', 'principal')
+        # Salida local (archivo o RTMP propio) en lugar de YouTube; admite strftime
+        self.salida = config.get('salida')
+        self.salida_respaldo = config.get('salida_respaldo')
+        # Destinos adicionales del tee y grabación local rotativa de este canal
+        self.salidas_extra = config.get('salidas_extra', SALIDAS_EXTRA)
+        self.grabacion = config.get('grabacion') or (GRABACION_DIR and os.path.join(GRABACION_DIR, self.nombre))
+        self.categorias = config.get('categorias')
+        self.duracion = timedelta(hours=config.get('horas', 8))
+        self.proceso = None
+        self.respaldo = None
+        self.evento_salida = threading.Event()
+        self.coste_cpu = None
+        self.muestra_cpu = None
+        self.en_emision = False
+        # El encoder en espera lleva su propio backoff: sus caídas no adelantan
+        # el cortacircuitos del principal
+        self.control_reinicios = ControlReinicios(f"el canal {self.nombre}")
+        self.control_respaldo = ControlReinicios(f"el respaldo del canal {self.nombre}")
+        self.inicio_respaldo = None
+        self.respaldo_pendiente = None
+        self.total_reinicios = 0
+        self.ultimo_reinicio = None
+        self.inicio_encoder = None
+        self.lanzado_en = None
+        self.posicion_base = 0.0
+        self.reconexion_desde = None
+        self.latencia_reconexion = None
+        self.telemetria = {}
+        self.ultimo_progreso = None
+        self.fases = {}
+
+    def coste_estimado(self):
+        if self.coste_cpu is not None:
+            return self.coste_cpu
+        # Sin medición propia: lo que cuesta el encoder en vivo según la calibración.
+        # Con pre-codificación el vivo solo remuxea y los núcleos de libx264 no aplican
+        perfil = {} if PREENCODIFICAR else obtener_perfil_encoder()
+        return perfil.get('nucleos') or COSTE_CPU_INICIAL
+
+    def lanzar(self, cmd, posicion=0.0):
+        # Cada ffmpeg en su propia sesión: las señales y caídas de un canal
+        # no alcanzan a los procesos de los demás
+        self.proceso = subprocess.Popen(cmd, start_new_session=True, stdout=subprocess.PIPE, text=True)
+        self.muestra_cpu = None
+        self.inicio_encoder = time.time()
+        self.lanzado_en = time.monotonic()
+        self.posicion_base = posicion
+        self.telemetria = {}
+        threading.Thread(
+            target=obtener_trazador().propagar(self.leer_progreso),
+            args=(self.proceso,),
+            name=f"progreso-{self.nombre}",
+            daemon=True
+        ).start()
+        return self.proceso
+
+    def lanzar_respaldo(self, cmd):
+        self.respaldo = subprocess.Popen(cmd, start_new_session=True, stdout=subprocess.DEVNULL)
+        self.inicio_respaldo = time.time()
+        self.respaldo_pendiente = None
+        threading.Thread(
+            target=self.esperar_respaldo,
+            args=(self.respaldo,),
+            name=f"respaldo-{self.nombre}",
+            daemon=True
+        ).start()
+        return self.respaldo
+
+    def esperar_respaldo(self, proceso):
+        proceso.wait()
+        self.evento_salida.set()
+
+    def leer_progreso(self, proceso):
+        """Lee los bloques clave=valor que ffmpeg escribe con -progress.
+
+        Al cerrarse la salida (el proceso terminó) despierta al supervisor
+        del canal sin esperar a ningún sondeo.
+        """
+        bloque = {}
+        for linea in proceso.stdout:
+            clave, _, valor = linea.strip().partition("=")
+            bloque[clave] = valor.strip()
+            if clave == "progress":
+                if proceso is self.proceso:
+                    primero = not (self.telemetria.get('frame') or 0)
+                    self.telemetria = interpretar_progreso(bloque)
+                    if primero and (self.telemetria.get('frame') or 0) > 0:
+                        # ffmpeg ya abrió entradas y salida y está entregando cuadros
+                        obtener_trazador().registrar(
+                            "primer_cuadro", self.lanzado_en, time.monotonic() - self.lanzado_en, canal=self.nombre
+                        )
+                    self.ultimo_progreso = time.time()
+                    if self.reconexion_desde:
+                        self.latencia_reconexion = time.monotonic() - self.reconexion_desde
+                        obtener_trazador().registrar(
+                            "reconexion", self.reconexion_desde, self.latencia_reconexion, canal=self.nombre
+                        )
+                        self.reconexion_desde = None
+                        logging.info(f"🔁 Encoder recuperado en {self.latencia_reconexion * 1000:.0f} ms")
+                bloque = {}
+        proceso.wait()
+        self.evento_salida.set()
+
+    def posicion_actual(self):
+        """Segundos emitidos desde el inicio del bucle, sumando todos los reinicios."""
+        return self.posicion_base + (self.telemetria.get('out_time') or 0.0)
+
+    def registrar_fase(self, fase, segundos):
+        self.fases[fase] = segundos
+        obtener_trazador().registrar(fase, time.monotonic() - segundos, segundos, canal=self.nombre)
+        logging.info(f"⏱️ Fase {fase}: {segundos:.1f}s")
+
+    def salud(self):
+        """Devuelve (ok, detalle) según el estado real del encoder."""
+        if not self.en_emision:
+            return True, "inactivo"
+        if not self.proceso:
+            # Admitido y preparando medios o esperando la hora programada
+            return True, "preparando"
+        if self.proceso.poll() is not None:
+            return False, "encoder caído"
+        if time.time() - self.inicio_encoder < 60:
+            return True, "arrancando"
+        if not self.ultimo_progreso or time.time() - self.ultimo_progreso > 30:
+            return False, "sin progreso del encoder"
+        velocidad = self.telemetria.get('speed')
+        if velocidad is not None and velocidad < 0.95:
+            return False, f"encoder por debajo de tiempo real ({velocidad:.2f}x)"
+        return True, "emitiendo"
+
+    def detener(self):
+        # Sin proceso hasta el próximo lanzar(): el ffmpeg muerto de la emisión
+        # anterior no debe contar como "encoder caído" mientras se prepara otra
+        detener_proceso(self.proceso)
+        detener_proceso(self.respaldo)
+        self.proceso = None
+        self.respaldo = None
+
+    def espera_reinicio(self):
+        """Segundos a esperar antes de relanzar el encoder caído."""
+        return self.control_reinicios.espera(self.inicio_encoder)
+
+    def programar_respaldo(self):
+        """Fija cuándo relanzar el encoder en espera caído; devuelve los segundos que faltan."""
+        if self.respaldo_pendiente is None:
+            espera = self.control_respaldo.espera(self.inicio_respaldo)
+            self.control_respaldo.registrar()
+            self.respaldo_pendiente = time.monotonic() + espera
+            logging.warning(f"⚡ Encoder de respaldo caído, relanzando en {espera:.1f}s...")
+        return max(self.respaldo_pendiente - time.monotonic(), 0.0)
+
+    def reiniciar(self, cmd, posicion):
+        self.control_reinicios.registrar()
+        self.total_reinicios += 1
+        self.ultimo_reinicio = time.time()
+        detener_proceso(self.proceso)
+        return self.lanzar(cmd, posicion)
+
+    def medir_cpu(self):
+        """Actualiza el coste de CPU del encoder (núcleos, media móvil)."""
+        if not self.proceso:
+            return
+        cpu = tiempo_cpu_proceso(self.proceso.pid)
+        ahora = time.monotonic()
+        if cpu is None:
+            return
+        if self.muestra_cpu and self.muestra_cpu[0] == self.proceso.pid and ahora > self.muestra_cpu[2]:
+            coste = (cpu - self.muestra_cpu[1]) / (ahora - self.muestra_cpu[2])
+            self.coste_cpu = coste if self.coste_cpu is None else 0.7 * self.coste_cpu + 0.3 * coste
+        self.muestra_cpu = (self.proceso.pid, cpu, ahora)
+
+class SupervisorCanales:
+    """Arranca los canales y admite o aplaza emisiones según el presupuesto de CPU."""
+
+    def __init__(self, canales, presupuesto=PRESUPUESTO_CPU):
+        self.canales = canales
+        self.presupuesto = presupuesto
+        self.lock = threading.Lock()
+
+    def carga(self):
+        return sum(c.coste_estimado() for c in self.canales if c.en_emision)
+
+    def admitir(self, canal):
+        with self.lock:
+            if canal.en_emision:
+                return True
+            carga = self.carga()
+            # Con el host vacío siempre se admite al menos un canal
+            if carga > 0 and carga + canal.coste_estimado() > self.presupuesto:
+                logging.warning(
+                    f"⏸️ Canal {canal.nombre} aplazado: carga {carga:.2f} + "
+                    f"{canal.coste_estimado():.2f} > {self.presupuesto:.2f} núcleos"
+                )
+                return False
+            canal.en_emision = True
+            return True
+
+    def liberar(self, canal):
+        with self.lock:
+            canal.en_emision = False
+
+    def iniciar(self):
+        for canal in self.canales:
+            threading.Thread(
+                target=ciclo_transmision,
+                args=(canal, self),
+                name=f"canal-{canal.nombre}",
+                daemon=True
+            ).start()
+
+def cargar_canales():
+    if not CANALES_CONFIG:
+        return [Canal({"nombre": "principal"})]
+    with open(CANALES_CONFIG) as f:
+        return [Canal(config) for config in json.load(f)]
+
+def manejar_transmision(stream_data, youtube, canal, supervisor):
+    try:
+        fin_previo = None
+        previo = stream_data.get('previo')
+        if previo:
+            # Relevo: el encoder arranca en cuanto el broadcast anterior suelta la ingesta.
+            # Sin timeout: el finally del anterior siempre marca 'terminado', y hasta
+            # entonces ese hilo puede seguir relanzando el Canal.proceso compartido
+            logging.info("⏳ Relevo preparado, esperando el fin de la emisión actual...")
+            with obtener_trazador().tramo("espera_relevo"):
+                previo['terminado'].wait()
+            fin_previo = previo.get('terminado_en')
+            # Sin esta referencia cada emisión retendría toda la cadena de relevos anteriores
+            stream_data['previo'] = previo = None
+        else:
+            tiempo_inicio_ffmpeg = stream_data['start_time'] - timedelta(minutes=1)
+            espera_ffmpeg = (tiempo_inicio_ffmpeg - datetime.utcnow()).total_seconds()
+            
+            if espera_ffmpeg > 0:
+                logging.info(f"⏳ Esperando {espera_ffmpeg:.0f} segundos para iniciar FFmpeg...")
+                with obtener_trazador().tramo("espera_programada"):
+                    time.sleep(espera_ffmpeg)
         
-        max_checks = 10
-        stream_activo = False
-        for _ in range(max_checks):
-            estado = youtube.obtener_estado_stream(stream_data['stream_id'])
-            if estado == 'active':
-                logging.info("✅ Stream activo - Transicionando a testing")
-                if youtube.transicionar_estado(stream_data['broadcast_id'], 'testing'):
-                    logging.info("🎬 Transmisión en VISTA PREVIA")
-                    stream_activo = True
-                break
-            time.sleep(5)
+        cmd = construir_comando_ffmpeg(stream_data)
         
-        if not stream_activo:
-            logging.error("❌ Stream no se activó a tiempo")
-            proceso.kill()
-            return
+        canal.evento_salida.clear()
+        canal.lanzar(cmd)
+        if ENCODER_RESPALDO and stream_data.get('rtmp_respaldo'):
+            # Encoder independiente: cubre también las caídas del principal, a costa de CPU
+            canal.lanzar_respaldo(construir_comando_ffmpeg(stream_data, destino=stream_data['rtmp_respaldo']))
+            logging.info("🟡 Encoder de respaldo publicando en la ingesta secundaria")
+        logging.info("🟢 FFmpeg iniciado - Estableciendo conexión RTMP...")
+        inicio_fase = time.monotonic()
         
-        tiempo_restante = (stream_data['start_time'] - datetime.utcnow()).total_seconds()
-        if tiempo_restante > 0:
-            logging.info(f"⏳ Esperando {tiempo_restante:.0f}s para LIVE...")
-            time.sleep(tiempo_restante)
+        if youtube:
+            ciclo_vida = stream_data['ciclo_vida']
+            if not youtube.esperar_stream_activo(stream_data['stream_id']):
+                logging.error("❌ Stream no se activó a tiempo")
+                canal.detener()
+                cerrar_broadcast(youtube, stream_data)
+                return
+            ciclo_vida.avanzar("ready")
+            canal.registrar_fase("espera_activo", time.monotonic() - inicio_fase)
+            
+            logging.info("✅ Stream activo - Transicionando a testing")
+            if not (youtube.transicionar_estado(stream_data['broadcast_id'], 'testing')
+                    and youtube.esperar_estado_broadcast(stream_data['broadcast_id'], 'testing')):
+                logging.error("❌ No se pudo pasar a testing")
+                canal.detener()
+                cerrar_broadcast(youtube, stream_data)
+                return
+            ciclo_vida.avanzar("testing")
+            logging.info("🎬 Transmisión en VISTA PREVIA")
+            
+            tiempo_restante = (stream_data['start_time'] - datetime.utcnow()).total_seconds()
+            if tiempo_restante > 0:
+                logging.info(f"⏳ Esperando {tiempo_restante:.0f}s para LIVE...")
+                with obtener_trazador().tramo("espera_live"):
+                    time.sleep(tiempo_restante)
+            
+            inicio_fase = time.monotonic()
+            if (youtube.transicionar_estado(stream_data['broadcast_id'], 'live')
+                    and youtube.esperar_estado_broadcast(stream_data['broadcast_id'], 'live')):
+                canal.registrar_fase("transicion_live", time.monotonic() - inicio_fase)
+                ciclo_vida.avanzar("live")
+                logging.info("🎥 Transmisión LIVE iniciada")
+                if fin_previo:
+                    canal.registrar_fase("hueco_relevo", time.monotonic() - fin_previo)
+            else:
+                raise Exception("No se pudo iniciar la transmisión")
         
-        if youtube.transicionar_estado(stream_data['broadcast_id'], 'live'):
-            logging.info("🎥 Transmisión LIVE iniciada")
-        else:
-            raise Exception("No se pudo iniciar la transmisión")
-        
-        tiempo_inicio = datetime.utcnow()
-        while (datetime.utcnow() - tiempo_inicio) < timedelta(hours=8):
-            if proceso.poll() is not None:
-                logging.warning("⚡ Reconectando FFmpeg...")
-                proceso.kill()
-                proceso = subprocess.Popen(cmd)
-            time.sleep(15)
-        
-        proceso.kill()
-        youtube.finalizar_transmision(stream_data['broadcast_id'])
+        while True:
+            # Se relee en cada vuelta: el fin de la emisión puede adelantarse
+            restante = (stream_data['end_time'] - datetime.utcnow()).total_seconds()
+            if restante <= 0:
+                break
+            
+            # Se despierta en cuanto cualquiera de los ffmpeg termina o toca
+            # relanzar el de respaldo
+            espera_evento = min(15, restante)
+            if canal.respaldo_pendiente is not None:
+                espera_evento = min(espera_evento, max(canal.respaldo_pendiente - time.monotonic(), 0))
+            canal.evento_salida.wait(timeout=espera_evento)
+            canal.evento_salida.clear()
+            
+            if canal.proceso.poll() is not None:
+                detectado = time.monotonic()
+                posicion = canal.posicion_actual()
+                # El enfriamiento no puede alargar la emisión más allá de su fin
+                restante = (stream_data['end_time'] - datetime.utcnow()).total_seconds()
+                espera = min(canal.espera_reinicio(), max(restante, 0))
+                logging.warning(
+                    f"⚡ FFmpeg terminó (código {canal.proceso.returncode}), "
+                    f"relanzando en {espera:.1f}s desde {posicion:.0f}s del bucle..."
+                )
+                if espera:
+                    time.sleep(espera)
+                if (stream_data['end_time'] - datetime.utcnow()).total_seconds() <= 0:
+                    continue
+                canal.reconexion_desde = detectado
+                canal.reiniciar(construir_comando_ffmpeg(stream_data, posicion), posicion)
+            
+            if canal.respaldo and canal.respaldo.poll() is not None and not canal.programar_respaldo():
+                logging.warning("⚡ Relanzando encoder de respaldo...")
+                canal.lanzar_respaldo(construir_comando_ffmpeg(
+                    stream_data, canal.posicion_actual(), destino=stream_data['rtmp_respaldo']
+                ))
+            
+            canal.medir_cpu()
+        
+        canal.detener()
+        liberar_relevo(stream_data)
+        if youtube:
+            cerrar_broadcast(youtube, stream_data)
         logging.info("🛑 Transmisión finalizada y archivada correctamente")
 
     except Exception as e:
         logging.error(f"Error en hilo de transmisión: {str(e)}")
-        youtube.finalizar_transmision(stream_data['broadcast_id'])
+        if youtube:
+            cerrar_broadcast(youtube, stream_data)
     
     finally:
-        logging.info("🧹 Limpiando caché de medios...")
-        media_cache_dir = os.path.abspath("./media_cache")
-        if os.path.exists(media_cache_dir):
-            shutil.rmtree(media_cache_dir, ignore_errors=True)
-        os.makedirs(media_cache_dir, exist_ok=True)
-
-def ciclo_transmision():
-    youtube = YouTubeManager()
+        if not stream_data['terminado'].is_set():
+            canal.detener()
+            liberar_relevo(stream_data)
+        # Con un relevo en marcha el canal conserva su hueco de CPU; el traspaso
+        # ya ocurrió, así que la referencia al sucesor sobra
+        if not stream_data.pop('sucesor', None):
+            supervisor.liberar(canal)
+        logging.info("🧹 Liberando medios de la caché...")
+        obtener_cache().soltar(stream_data['claves_cache'])
+        obtener_trazador().finalizar_traza(stream_data.get('traza'))
+
+def cerrar_broadcast(youtube, stream_data):
+    """Completa el broadcast si llegó a testing/live; si no, lo elimina.
+
+    Todos los broadcasts comparten el stream de ingesta persistente: uno
+    abandonado con autoarranque saldría al aire con el encoder del siguiente.
+    """
+    ciclo_vida = stream_data['ciclo_vida']
+    if ciclo_vida.estado == "complete":
+        return
+    if ciclo_vida.estado in ("testing", "live"):
+        cerrado = youtube.finalizar_transmision(stream_data['broadcast_id'])
+    else:
+        cerrado = youtube.eliminar_transmision(stream_data['broadcast_id'])
+        if cerrado:
+            logging.info(f"🗑️ Broadcast {stream_data['broadcast_id']} eliminado sin llegar a emitirse")
+    if cerrado:
+        ciclo_vida.avanzar("complete")
+
+def liberar_relevo(stream_data):
+    stream_data['terminado_en'] = time.monotonic()
+    stream_data['terminado'].set()
+
+def preparar_transmision(canal, youtube, siguiente_par, previo=None):
+    """Elige y prepara medios y crea el broadcast; con previo, lo programa como relevo."""
+    inicio_fase = time.monotonic()
+    gestor = GestorContenido()
+    canal.registrar_fase("manifiesto", time.monotonic() - inicio_fase)
+    if not gestor.medios['videos'] or not gestor.medios['sonidos_naturaleza']:
+        raise Exception("Catálogo vacío: sin manifiesto remoto ni copia local")
+    video = gestor.elegir_video(
+        siguiente_par.get('video'),
+        excluir=previo['video']['name'] if previo else None,
+        categorias=canal.categorias
+    )
+    logging.info(f"🎥 Video seleccionado: {video['name']}")
+    
+    categoria = determinar_categoria(video['name'])
+    logging.info(f"🏷️ Categoría detectada: {categoria}")
+    
+    audio = gestor.elegir_audio(categoria, siguiente_par.get('audio'))
+    logging.info(f"🔊 Audio seleccionado: {audio['name']}")
+    
+    claves_cache = [video['url'], audio['url']]
+    gestor.cache.fijar(claves_cache)
+    try:
+        inicio_fase = time.monotonic()
+        gestor.preparar(video, audio, siguiente_par.get('musica'))
+        canal.registrar_fase("preparacion_medios", time.monotonic() - inicio_fase)
+        if not video.get('local_path'):
+            raise Exception("Video no descargado correctamente")
+        if not audio.get('local_path'):
+            raise Exception("Audio no descargado correctamente")
+        if video.get('emision_path'):
+            claves_cache.append(video['clave_emision'])
+            gestor.cache.fijar([video['clave_emision']])
+        if audio.get('mezcla_path'):
+            claves_cache.append(audio['clave_mezcla'])
+            gestor.cache.fijar([audio['clave_mezcla']])
+            logging.info(f"🎼 Fondo de audio con música: {audio['mezcla_path']}")
+        
+        titulo = generar_titulo(video['name'], categoria)
+        logging.info(f"📝 Título generado: {titulo}")
+        
+        inicio = previo['end_time'] if previo else None
+        inicio_fase = time.monotonic()
+        if canal.salida:
+            stream_info = {
+                "rtmp": (inicio or datetime.utcnow()).strftime(canal.salida),
+                "rtmp_respaldo": canal.salida_respaldo and (inicio or datetime.utcnow()).strftime(canal.salida_respaldo),
+                "scheduled_start": inicio or datetime.utcnow(),
+                "broadcast_id": None,
+                "stream_id": None
+            }
+        else:
+            stream_info = youtube.crear_transmision(titulo, video.get('miniatura'), inicio)
+        if not stream_info:
+            raise Exception("Error creación transmisión")
+        canal.registrar_fase("creacion_transmision", time.monotonic() - inicio_fase)
+    except Exception:
+        gestor.cache.soltar(claves_cache)
+        raise
+    
+    stream_data = {
+        "rtmp": stream_info['rtmp'],
+        "start_time": stream_info['scheduled_start'],
+        "video": video,
+        "audio": audio,
+        "broadcast_id": stream_info['broadcast_id'],
+        "stream_id": stream_info['stream_id'],
+        "ciclo_vida": CicloVidaBroadcast(stream_info['broadcast_id'], canal) if youtube else None,
+        "rtmp_respaldo": stream_info.get('rtmp_respaldo'),
+        "canal": canal.nombre,
+        "salidas_extra": canal.salidas_extra,
+        "grabacion": canal.grabacion,
+        "duracion_video": duracion_medio(video.get('emision_path') or video['local_path']),
+        "duracion_audio": duracion_medio(audio.get('mezcla_path') or audio['local_path']),
+        "claves_cache": claves_cache,
+        "previo": previo,
+        "terminado": threading.Event(),
+        "end_time": stream_info['scheduled_start'] + canal.duracion
+    }
+    
+    if gestor.perezoso and PRECARGAR_SIGUIENTE:
+        stream_data['siguiente_par'] = gestor.precargar_siguiente(video['name'], canal.categorias)
+    return stream_data
+
+def preparar_transmision_trazada(canal, youtube, siguiente_par, previo=None):
+    """preparar_transmision dentro de una traza nueva, que sigue abierta durante toda la emisión."""
+    trazador = obtener_trazador()
+    traza = trazador.iniciar_traza(f"emision-{canal.nombre}", canal=canal.nombre, relevo=previo is not None)
+    try:
+        with trazador.activar(traza), trazador.tramo("preparacion"):
+            stream_data = preparar_transmision(canal, youtube, siguiente_par, previo)
+    except Exception:
+        trazador.finalizar_traza(traza)
+        raise
+    stream_data['traza'] = traza
+    return stream_data
+
+def ciclo_transmision(canal, supervisor):
+    youtube = None if canal.salida else YouTubeManager(canal.nombre)
     current_stream = None
     
     while True:
         try:
+            if current_stream and not current_stream['hilo'].is_alive() and not current_stream.get('sucesor'):
+                # La emisión terminó sin relevo (fallo o relevo no preparado a tiempo)
+                current_stream = None
+            
             if not current_stream:
-                gestor = GestorContenido()
-                video = random.choice(gestor.medios['videos'])
-                if not video.get('local_path'):
-                    raise Exception("Video no descargado correctamente")
-                
-                logging.info(f"🎥 Video seleccionado: {video['name']}")
-                
-                categoria = determinar_categoria(video['name'])
-                logging.info(f"🏷️ Categoría detectada: {categoria}")
-                
-                audio = seleccionar_audio_compatible(gestor, categoria)
-                if not audio.get('local_path'):
-                    raise Exception("Audio no descargado correctamente")
-                logging.info(f"🔊 Audio seleccionado: {audio['name']}")
-                
-                titulo = generar_titulo(video['name'], categoria)
-                logging.info(f"📝 Título generado: {titulo}")
-                
-                stream_info = youtube.crear_transmision(titulo, video['local_path'])
-                if not stream_info:
-                    raise Exception("Error creación transmisión")
-                
-                current_stream = {
-                    "rtmp": stream_info['rtmp'],
-                    "start_time": stream_info['scheduled_start'],
-                    "video": video,
-                    "audio": audio,
-                    "broadcast_id": stream_info['broadcast_id'],
-                    "stream_id": stream_info['stream_id'],
-                    "end_time": stream_info['scheduled_start'] + timedelta(hours=8)
-                }
-
-                threading.Thread(
-                    target=manejar_transmision,
-                    args=(current_stream, youtube),
-                    daemon=True
-                ).start()
-                
-                next_stream_time = current_stream['end_time'] + timedelta(minutes=5)
+                if not supervisor.admitir(canal):
+                    time.sleep(60)
+                    continue
+                current_stream = preparar_transmision_trazada(canal, youtube, {})
+            
+            elif datetime.utcnow() >= current_stream['end_time'] - ANTELACION_RELEVO and not current_stream.get('sucesor'):
+                logging.info("🔄 Preparando el relevo mientras la emisión sigue al aire...")
+                siguiente = preparar_transmision_trazada(
+                    canal, youtube, current_stream.get('siguiente_par', {}), previo=current_stream
+                )
+                current_stream['sucesor'] = siguiente
+                if current_stream['terminado'].is_set():
+                    # Se llegó tarde: el relevo arranca como emisión nueva y, si el
+                    # anterior ya soltó su hueco de CPU, pasa otra vez por admisión
+                    siguiente['previo'] = None
+                    while not supervisor.admitir(canal):
+                        time.sleep(60)
+                current_stream = siguiente
             
             else:
-                if datetime.utcnow() >= next_stream_time:
-                    current_stream = None
-                    logging.info("🔄 Preparando nueva transmisión...")
-                
                 time.sleep(15)
+                continue
+            
+            current_stream['hilo'] = threading.Thread(
+                target=obtener_trazador().propagar(manejar_transmision, current_stream['traza']),
+                args=(current_stream, youtube, canal, supervisor),
+                name=f"emision-{canal.nombre}",
+                daemon=True
+            )
+            current_stream['hilo'].start()
         
         except Exception as e:
             logging.error(f"🔥 Error crítico: {str(e)}")
-            current_stream = None
+            if current_stream is None:
+                supervisor.liberar(canal)
             time.sleep(60)
 
+supervisor = None
+
+def arrancar_canales(supervisor):
+    """Calibra el encoder (solo si el vivo codifica) y arranca los canales.
+
+    Corre en segundo plano: el servidor HTTP ya atiende /health mientras tanto.
+    """
+    if CALIBRAR_ENCODER and not PREENCODIFICAR:
+        try:
+            calibrar_encoder(len(supervisor.canales))
+        except Exception as e:
+            logging.error(f"Error calibrando encoder: {str(e)}")
+    supervisor.iniciar()
+
+def formatear_metricas(canales, descargador):
+    """Exporta el estado de los encoders y descargas en formato de texto Prometheus."""
+    lineas = []
+    
+    def metrica(nombre, tipo, ayuda, muestras):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for etiquetas, valor in muestras:
+            if valor is None:
+                continue
+            texto = ",".join(f'{k}="{v}"' for k, v in etiquetas.items())
+            lineas.append(f"{nombre}{{{texto}}} {valor}" if texto else f"{nombre} {valor}")
+    
+    ahora = time.time()
+    encoder = [
+        ("fps", "relax_encoder_fps", "gauge", "Cuadros por segundo del encoder"),
+        ("speed", "relax_encoder_speed_ratio", "gauge", "Velocidad del encoder respecto a tiempo real"),
+        ("out_time", "relax_encoder_out_time_seconds", "gauge", "Posición de salida en segundos"),
+        ("bitrate_kbps", "relax_encoder_bitrate_kbps", "gauge", "Bitrate de salida en kbit/s"),
+        ("total_size", "relax_encoder_output_bytes_total", "counter", "Bytes escritos por el encoder"),
+        ("drop_frames", "relax_encoder_dropped_frames_total", "counter", "Cuadros descartados"),
+        ("dup_frames", "relax_encoder_duplicated_frames_total", "counter", "Cuadros duplicados")
+    ]
+    for campo, nombre, tipo, ayuda in encoder:
+        metrica(nombre, tipo, ayuda, [
+            ({"canal": c.nombre}, c.telemetria.get(campo)) for c in canales
+        ])
+    
+    metrica("relax_encoder_up", "gauge", "1 si el encoder del canal está corriendo", [
+        ({"canal": c.nombre}, int(bool(c.proceso and c.proceso.poll() is None))) for c in canales
+    ])
+    metrica("relax_encoder_cpu_cores", "gauge", "Núcleos de CPU consumidos por el encoder", [
+        ({"canal": c.nombre}, c.coste_cpu) for c in canales
+    ])
+    metrica("relax_encoder_restarts_total", "counter", "Reinicios del encoder", [
+        ({"canal": c.nombre}, c.total_reinicios) for c in canales
+    ])
+    metrica("relax_encoder_seconds_since_restart", "gauge", "Segundos desde el último reinicio", [
+        ({"canal": c.nombre}, ahora - c.ultimo_reinicio if c.ultimo_reinicio else None) for c in canales
+    ])
+    metrica("relax_encoder_reconnect_latency_seconds", "gauge", "Latencia de la última recuperación del encoder", [
+        ({"canal": c.nombre}, c.latencia_reconexion) for c in canales
+    ])
+    metrica("relax_standby_up", "gauge", "1 si el encoder de respaldo está corriendo", [
+        ({"canal": c.nombre}, int(bool(c.respaldo and c.respaldo.poll() is None))) for c in canales
+    ])
+    cuota = obtener_cuota()
+    metrica("relax_youtube_quota_used_units", "gauge", "Unidades de cuota gastadas hoy", [({}, cuota.limite - cuota.restante())])
+    metrica("relax_youtube_quota_remaining_units", "gauge", "Unidades de cuota restantes hoy", [({}, cuota.restante())])
+    manifiesto = obtener_manifiesto()
+    metrica("relax_manifest_seconds_since_sync", "gauge", "Segundos desde la última sincronización correcta del manifiesto", [
+        ({}, manifiesto.ultima_sincronizacion and round(time.time() - manifiesto.ultima_sincronizacion, 1))
+    ])
+    metrica("relax_phase_duration_seconds", "gauge", "Duración de la última ejecución de cada fase", [
+        ({"canal": c.nombre, "fase": fase}, segundos) for c in canales for fase, segundos in c.fases.items()
+    ])
+    
+    histogramas = obtener_trazador().resumen_histogramas()
+    lineas.append("# HELP relax_span_duration_seconds Duración de cada tramo trazado")
+    lineas.append("# TYPE relax_span_duration_seconds histogram")
+    for tramo, histograma in sorted(histogramas.items()):
+        acumulado = 0
+        for limite, cuenta in zip(list(CUBETAS_LATENCIA) + ["+Inf"], histograma['cubetas']):
+            acumulado += cuenta
+            lineas.append(f'relax_span_duration_seconds_bucket{{tramo="{tramo}",le="{limite}"}} {acumulado}')
+        lineas.append(f'relax_span_duration_seconds_sum{{tramo="{tramo}"}} {round(histograma["suma"], 6)}')
+        lineas.append(f'relax_span_duration_seconds_count{{tramo="{tramo}"}} {histograma["total"]}')
+    
+    datos = descargador.metricas()
+    for campo in ("descargas", "fallos", "reintentos", "reanudaciones", "bytes"):
+        metrica(f"relax_download_{campo}_total", "counter", f"Descargas: {campo}", [({}, datos[campo])])
+    metrica("relax_download_mb_per_second", "gauge", "Rendimiento medio de descarga", [({}, datos['mb_por_segundo'])])
+    
+    return "\n".join(lineas) + "\n"
+
+@app.route('/metrics')
+def metrics():
+    canales = supervisor.canales if supervisor else []
+    return formatear_metricas(canales, obtener_descargador()), 200, {
+        "Content-Type": "text/plain; version=0.0.4; charset=utf-8"
+    }
+
 @app.route('/health')
 def health_check():
+    if not supervisor:
+        return "OK", 200
+    problemas = []
+    for canal in supervisor.canales:
+        ok, detalle = canal.salud()
+        if not ok:
+            problemas.append(f"{canal.nombre}: {detalle}")
+    if problemas:
+        return "; ".join(problemas), 503
     return "OK", 200
 
+def percentil(histograma, q):
+    """Límite superior de la cubeta que contiene el percentil q."""
+    objetivo = q * histograma['total']
+    acumulado = 0
+    for limite, cuenta in zip(CUBETAS_LATENCIA, histograma['cubetas']):
+        acumulado += cuenta
+        if acumulado >= objetivo:
+            return limite
+    return None
+
+@app.route('/debug/timeline')
+def debug_timeline():
+    trazador = obtener_trazador()
+    limite = request.args.get('limite', type=int)
+    return jsonify({
+        "trazas": trazador.linea_temporal(limite),
+        "histogramas": {
+            tramo: {
+                "total": h['total'],
+                "media_ms": round(h['suma'] / h['total'] * 1000, 1),
+                "p50_s": percentil(h, 0.5),
+                "p90_s": percentil(h, 0.9),
+                "p99_s": percentil(h, 0.99)
+            }
+            for tramo, h in sorted(trazador.resumen_histogramas().items())
+        }
+    })
+
 if __name__ == "__main__":
     logging.info("🎬 Iniciando servicio de streaming...")
-    threading.Thread(target=ciclo_transmision, daemon=True).start()
+    canales = cargar_canales()
+    if "--calibrar" in sys.argv:
+        # Solo calibrar (ignorando la caché) y salir
+        calibrar_encoder(len(canales), forzar=True)
+        sys.exit(0)
+    supervisor = SupervisorCanales(canales)
+    threading.Thread(target=arrancar_canales, args=(supervisor,), name="arranque", daemon=True).start()
     serve(app, host='0.0.0.0', port=10000)
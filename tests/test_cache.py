@@ -0,0 +1,157 @@
+"""CacheMedios: presupuesto LRU, claves fijadas y borrado diferido."""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+DIRECTORIO = tempfile.mkdtemp(prefix="relax_test_")
+os.environ.setdefault("MEDIA_CACHE_DIR", os.path.join(DIRECTORIO, "media_cache"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class TestCacheMedios(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(DIRECTORIO, ignore_errors=True)
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(dir=DIRECTORIO)
+        self.cache = main.CacheMedios(self.directorio, limite_bytes=3000)
+        self.reloj = 1000.0
+        parche = mock.patch("main.time.time", side_effect=self.avanzar)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def avanzar(self):
+        self.reloj += 1
+        return self.reloj
+
+    def registrar(self, clave, tamano, contenido=None):
+        temporal = os.path.join(self.directorio, f"{len(os.listdir(self.directorio))}.tmp")
+        with open(temporal, "wb") as f:
+            f.write((contenido or clave.encode()).ljust(tamano, b"."))
+        return self.cache.registrar(clave, temporal, ".bin")
+
+    def test_desaloja_los_menos_usados_hasta_el_presupuesto(self):
+        a = self.registrar("a", 1000)
+        self.registrar("b", 1000)
+        self.registrar("c", 1000)
+        # Usar "a" la convierte en la más reciente: la víctima pasa a ser "b"
+        self.cache.obtener("a")
+        d = self.registrar("d", 1000)
+
+        self.assertEqual(set(self.cache.entradas), {"a", "c", "d"})
+        self.assertTrue(os.path.exists(a['ruta']))
+        self.assertTrue(os.path.exists(d['ruta']))
+        self.assertEqual(len(os.listdir(self.cache.directorio_objetos)), 3)
+
+    def test_las_claves_fijadas_no_se_desalojan(self):
+        a = self.registrar("a", 1500)
+        self.cache.fijar(["a"])
+        self.registrar("b", 1500)
+        self.registrar("c", 1500)
+
+        self.assertIn("a", self.cache.entradas)
+        self.assertTrue(os.path.exists(a['ruta']))
+        self.assertNotIn("b", self.cache.entradas)
+
+        # Al soltarla vuelve a competir por el presupuesto como la más antigua
+        self.cache.soltar(["a"])
+        self.registrar("d", 1500)
+        self.assertEqual(set(self.cache.entradas), {"c", "d"})
+        self.assertFalse(os.path.exists(a['ruta']))
+
+    def test_liberar_una_clave_fijada_difiere_el_borrado(self):
+        anterior = self.registrar("video", 100)
+        self.cache.fijar(["video"])
+        self.cache.liberar("video")
+
+        self.assertNotIn("video", self.cache.entradas)
+        self.assertTrue(os.path.exists(anterior['ruta']))
+
+        self.cache.soltar(["video"])
+        self.assertFalse(os.path.exists(anterior['ruta']))
+
+    def test_reemplazo_de_clave_fijada_conserva_el_objeto_en_emision(self):
+        anterior = self.registrar("video", 100, b"version 1")
+        self.cache.fijar(["video"])
+        self.cache.fijar(["video"])
+        nuevo = self.registrar("video", 100, b"version 2")
+
+        self.assertNotEqual(anterior['ruta'], nuevo['ruta'])
+        self.assertTrue(os.path.exists(anterior['ruta']))
+
+        # Dos emisiones la fijaron: el borrado espera a la última
+        self.cache.soltar(["video"])
+        self.assertTrue(os.path.exists(anterior['ruta']))
+        self.cache.soltar(["video"])
+        self.assertFalse(os.path.exists(anterior['ruta']))
+        self.assertTrue(os.path.exists(nuevo['ruta']))
+
+    def test_reemplazo_sin_fijar_borra_el_objeto_huerfano(self):
+        anterior = self.registrar("video", 100, b"version 1")
+        nuevo = self.registrar("video", 100, b"version 2")
+
+        self.assertFalse(os.path.exists(anterior['ruta']))
+        self.assertTrue(os.path.exists(nuevo['ruta']))
+
+    def test_objeto_compartido_sobrevive_a_una_de_sus_claves(self):
+        uno = self.registrar("uno", 100, b"mismo")
+        dos = self.registrar("dos", 100, b"mismo")
+        self.assertEqual(uno['ruta'], dos['ruta'])
+
+        self.cache.liberar("uno")
+        self.assertTrue(os.path.exists(dos['ruta']))
+        self.cache.liberar("dos")
+        self.assertFalse(os.path.exists(dos['ruta']))
+
+    def test_obtener_descarta_archivos_incompletos(self):
+        entrada = self.registrar("a", 100)
+        with open(entrada['ruta'], "ab") as f:
+            f.write(b"extra")
+
+        self.assertIsNone(self.cache.obtener("a"))
+        self.assertNotIn("a", self.cache.entradas)
+
+    def test_exclusivo_serializa_la_misma_clave(self):
+        orden = []
+        dentro = threading.Event()
+
+        def producir(nombre, clave):
+            with self.cache.exclusivo(clave):
+                orden.append(f"{nombre}+")
+                dentro.set()
+                time.sleep(0.05)
+                orden.append(f"{nombre}-")
+
+        primero = threading.Thread(target=producir, args=("a", "url"))
+        primero.start()
+        dentro.wait()
+        segundo = threading.Thread(target=producir, args=("b", "url"))
+        otra = threading.Thread(target=producir, args=("c", "otra"))
+        segundo.start()
+        otra.start()
+        for hilo in (primero, segundo, otra):
+            hilo.join()
+
+        self.assertLess(orden.index("a-"), orden.index("b+"))
+        # Una clave distinta no espera
+        self.assertLess(orden.index("c+"), orden.index("a-"))
+        self.assertEqual(self.cache.en_curso, {})
+
+    def test_indice_persistente(self):
+        entrada = self.registrar("a", 100)
+        recargada = main.CacheMedios(self.directorio, limite_bytes=3000)
+        self.assertEqual(recargada.entradas["a"]['ruta'], entrada['ruta'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""IndiceCatalogo: ventana sin repetición, relajación de restricciones y categorías múltiples."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import Counter
+
+DIRECTORIO = tempfile.mkdtemp(prefix="relax_test_")
+os.environ.setdefault("MEDIA_CACHE_DIR", os.path.join(DIRECTORIO, "media_cache"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def medios(*nombres, tipo="videos"):
+    return {tipo: [{"name": nombre, "url": f"https://medios.test/{i}"} for i, nombre in enumerate(nombres)]}
+
+
+class TestIndiceCatalogo(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(DIRECTORIO, ignore_errors=True)
+
+    def setUp(self):
+        main.random.seed(20240611)
+        main._historial_elecciones.clear()
+        self.addCleanup(main._historial_elecciones.clear)
+
+    def nombres(self, catalogo, veces, *args, **kwargs):
+        return [catalogo.elegir("videos", *args, **kwargs)['name'] for _ in range(veces)]
+
+    def test_no_repite_dentro_de_la_ventana(self):
+        catalogo = main.IndiceCatalogo(medios(*(f"Lluvia {i}" for i in range(8))), ventana=3)
+        elegidos = self.nombres(catalogo, 300)
+
+        for i, nombre in enumerate(elegidos):
+            self.assertNotIn(nombre, elegidos[max(i - 3, 0):i])
+        self.assertEqual(len(set(elegidos)), 8)
+
+    def test_ventana_mayor_que_la_categoria_se_relaja_dentro_de_ella(self):
+        catalogo = main.IndiceCatalogo(medios("Fuego 1", "Fuego 2", "Río 1", "Río 2", "Noche 1"), ventana=5)
+        elegidos = self.nombres(catalogo, 20, ["fuego"])
+
+        self.assertEqual(set(elegidos), {"Fuego 1", "Fuego 2"})
+
+    def test_categoria_agotada_recurre_al_catalogo_completo(self):
+        catalogo = main.IndiceCatalogo(medios("Fuego 1", "Río 1", "Noche 1"))
+        elegidos = self.nombres(catalogo, 20, ["fuego"], excluir={"Fuego 1"})
+
+        self.assertNotIn("Fuego 1", elegidos)
+        self.assertEqual(set(elegidos), {"Río 1", "Noche 1"})
+
+    def test_todo_excluido_ignora_la_exclusion(self):
+        catalogo = main.IndiceCatalogo(medios("Fuego 1"))
+        self.assertEqual(self.nombres(catalogo, 3, ["fuego"], excluir={"Fuego 1"}), ["Fuego 1"] * 3)
+
+    def test_sin_elegibles_elige_del_catalogo_completo(self):
+        catalogo = main.IndiceCatalogo(medios("Fuego 1", "Río 1"))
+        elegidos = self.nombres(catalogo, 20, ["fuego"], elegible=lambda medio: False)
+        self.assertEqual(set(elegidos), {"Fuego 1", "Río 1"})
+
+    def test_catalogo_vacio(self):
+        with self.assertRaises(ValueError):
+            main.IndiceCatalogo({"videos": []}).elegir("videos")
+
+    def test_medio_con_varias_categorias_entra_en_todas(self):
+        catalogo = main.IndiceCatalogo(medios("Lluvia Bosque", "Fuego Chimenea", "Río 1"), ventana=0)
+
+        self.assertEqual(catalogo.categorias_de("Lluvia Bosque"), {"lluvia", "bosque"})
+        self.assertEqual(set(self.nombres(catalogo, 10, ["bosque"])), {"Lluvia Bosque"})
+        self.assertEqual(set(self.nombres(catalogo, 10, ["lluvia"])), {"Lluvia Bosque"})
+
+    def test_medio_en_varias_bolsas_pedidas_no_pesa_doble_al_relajar(self):
+        catalogo = main.IndiceCatalogo(medios("Lluvia Bosque", "Bosque 1", "Lluvia 1"), ventana=10)
+        # Con la ventana llena todos los intentos fallan y decide el filtrado lineal
+        conteo = Counter(self.nombres(catalogo, 3000, ["lluvia", "bosque"])[3:])
+
+        self.assertEqual(set(conteo), {"Lluvia Bosque", "Bosque 1", "Lluvia 1"})
+        self.assertLess(max(conteo.values()) / min(conteo.values()), 1.2)
+
+    def test_palabras_clave_sin_tildes_ni_mayusculas(self):
+        self.assertEqual(main.normalizar_texto("LLuvia Cañón"), "lluvia canon")
+        self.assertEqual(main.categorias_de("Cascáda en el BOSQUE"), {"rio", "bosque"})
+        self.assertEqual(main.categoria_de("Río Río NOCHE"), "rio")
+
+        catalogo = main.IndiceCatalogo(medios("TORMENTA de Lluvia", "Río Nocturno", "Fuego"))
+        self.assertEqual(catalogo.categorias_de("Río Nocturno"), {"rio"})
+        self.assertEqual(set(self.nombres(catalogo, 5, ["rio"])), {"Río Nocturno"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Descargador contra un servidor local con soporte de Range que inyecta fallos."""
+
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+DIRECTORIO = tempfile.mkdtemp(prefix="relax_test_")
+os.environ.setdefault("MEDIA_CACHE_DIR", os.path.join(DIRECTORIO, "media_cache"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class ServidorDefectuoso(BaseHTTPRequestHandler):
+    """Sirve `contenido` con ETag y Range; los primeros `cortes` envíos se cortan a la mitad."""
+
+    contenido = b""
+    etag = '"v1"'
+    cortes = 0
+    comprimir = False
+    peticiones = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        clase = type(self)
+        clase.peticiones.append(dict(self.headers))
+        cuerpo = clase.contenido
+        rango = self.headers.get("Range")
+        desde = 0
+        if rango and self.headers.get("If-Range") == clase.etag:
+            desde = int(rango.split("=")[1].rstrip("-"))
+
+        codificacion = None
+        if clase.comprimir and "gzip" in self.headers.get("Accept-Encoding", ""):
+            cuerpo = gzip.compress(cuerpo)
+            codificacion = "gzip"
+
+        self.send_response(206 if desde else 200)
+        self.send_header("ETag", clase.etag)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        if codificacion:
+            self.send_header("Content-Encoding", codificacion)
+        if desde:
+            self.send_header("Content-Range", f"bytes {desde}-{len(cuerpo) - 1}/{len(cuerpo)}")
+        self.send_header("Content-Length", str(len(cuerpo) - desde))
+        self.end_headers()
+
+        restante = cuerpo[desde:]
+        if clase.cortes > 0:
+            clase.cortes -= 1
+            restante = restante[:len(restante) // 2]
+            self.close_connection = True
+        self.wfile.write(restante)
+
+
+class TestDescargador(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ThreadingHTTPServer(("127.0.0.1", 0), ServidorDefectuoso)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.servidor.server_port}/medio.bin"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        shutil.rmtree(DIRECTORIO, ignore_errors=True)
+
+    def setUp(self):
+        ServidorDefectuoso.contenido = os.urandom(3 * 1024 * 1024 + 17)
+        ServidorDefectuoso.etag = '"v1"'
+        ServidorDefectuoso.cortes = 0
+        ServidorDefectuoso.comprimir = False
+        ServidorDefectuoso.peticiones = []
+        self.destino = os.path.join(tempfile.mkdtemp(dir=DIRECTORIO), "medio.bin")
+        self.descargador = main.Descargador(tamano_bloque=64 * 1024)
+        # Sin esperas de backoff entre intentos
+        parche = mock.patch("main.time.sleep")
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def leer_destino(self):
+        with open(self.destino, "rb") as f:
+            return f.read()
+
+    def test_reanuda_tras_cortes(self):
+        ServidorDefectuoso.cortes = 2
+        resultado = self.descargador.descargar(self.url, self.destino)
+
+        self.assertEqual(self.leer_destino(), ServidorDefectuoso.contenido)
+        self.assertEqual(resultado["sha256"], hashlib.sha256(ServidorDefectuoso.contenido).hexdigest())
+        self.assertEqual(resultado["etag"], '"v1"')
+        self.assertTrue(any("Range" in p for p in ServidorDefectuoso.peticiones[1:]))
+        metricas = self.descargador.metricas()
+        self.assertEqual(metricas["reintentos"], 2)
+        self.assertGreaterEqual(metricas["reanudaciones"], 1)
+        self.assertFalse(os.path.exists(self.destino + ".part"))
+        self.assertFalse(os.path.exists(self.destino + ".part.json"))
+
+    def test_cambio_en_origen_reinicia_descarga(self):
+        ServidorDefectuoso.cortes = 1
+        original = ServidorDefectuoso.contenido
+
+        def cambiar_origen(*args):
+            # Tras el corte el archivo cambia: If-Range ya no coincide y llega un 200 completo
+            ServidorDefectuoso.contenido = original[::-1]
+            ServidorDefectuoso.etag = '"v2"'
+
+        with mock.patch("main.time.sleep", side_effect=cambiar_origen):
+            resultado = self.descargador.descargar(self.url, self.destino)
+
+        self.assertEqual(self.leer_destino(), original[::-1])
+        self.assertEqual(resultado["sha256"], hashlib.sha256(original[::-1]).hexdigest())
+        self.assertEqual(resultado["etag"], '"v2"')
+
+    def test_pide_representacion_sin_comprimir(self):
+        ServidorDefectuoso.comprimir = True
+        ServidorDefectuoso.contenido = b"relax " * 200000
+        ServidorDefectuoso.cortes = 1
+        resultado = self.descargador.descargar(self.url, self.destino)
+
+        self.assertEqual(self.leer_destino(), ServidorDefectuoso.contenido)
+        self.assertEqual(resultado["bytes"], len(ServidorDefectuoso.contenido))
+        self.assertTrue(all(p.get("Accept-Encoding") == "identity" for p in ServidorDefectuoso.peticiones))
+
+    def test_agota_reintentos(self):
+        ServidorDefectuoso.cortes = 10
+        with self.assertRaises(main.requests.RequestException):
+            self.descargador.descargar(self.url, self.destino)
+        self.assertEqual(self.descargador.metricas()["fallos"], 1)
+        self.assertTrue(os.path.exists(self.destino + ".part"))
+
+
+if __name__ == "__main__":
+    unittest.main()
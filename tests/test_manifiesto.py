@@ -0,0 +1,159 @@
+"""SincronizadorManifiesto contra un servidor local con ETag/304 que puede caerse."""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+DIRECTORIO = tempfile.mkdtemp(prefix="relax_test_")
+os.environ.setdefault("MEDIA_CACHE_DIR", os.path.join(DIRECTORIO, "media_cache"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def manifiesto(videos=(), sonidos=()):
+    return {
+        "videos": [{"name": nombre, "url": url} for nombre, url in videos],
+        "musica": [],
+        "sonidos_naturaleza": [{"name": nombre, "url": url} for nombre, url in sonidos]
+    }
+
+
+class ServidorManifiesto(BaseHTTPRequestHandler):
+    """Sirve `datos` con ETag; responde 304 si If-None-Match coincide y 503 si `caido`."""
+
+    datos = {}
+    etag = '"m1"'
+    caido = False
+    peticiones = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        clase = type(self)
+        clase.peticiones.append(dict(self.headers))
+        if clase.caido:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == clase.etag:
+            self.send_response(304)
+            self.send_header("ETag", clase.etag)
+            self.end_headers()
+            return
+        cuerpo = json.dumps(clase.datos).encode()
+        self.send_response(200)
+        self.send_header("ETag", clase.etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+
+class TestSincronizadorManifiesto(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.servidor = ThreadingHTTPServer(("127.0.0.1", 0), ServidorManifiesto)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.servidor.server_port}/medios.json"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        shutil.rmtree(DIRECTORIO, ignore_errors=True)
+
+    def setUp(self):
+        ServidorManifiesto.datos = manifiesto(
+            videos=[("Lluvia", "https://medios.test/lluvia.mp4"), ("Fuego", "https://medios.test/fuego.mp4")],
+            sonidos=[("Río", "https://medios.test/rio.mp3")]
+        )
+        ServidorManifiesto.etag = '"m1"'
+        ServidorManifiesto.caido = False
+        ServidorManifiesto.peticiones = []
+        self.directorio = tempfile.mkdtemp(dir=DIRECTORIO)
+        self.ruta = os.path.join(self.directorio, "manifiesto.json")
+        self.semilla = os.path.join(self.directorio, "medios.json")
+        self.cache = mock.Mock()
+        parche = mock.patch("main.obtener_cache", return_value=self.cache)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def sincronizador(self):
+        return main.SincronizadorManifiesto(url=self.url, ruta=self.ruta, semilla=self.semilla)
+
+    def nombres(self, datos, tipo="videos"):
+        return [m['name'] for m in datos[tipo]]
+
+    def test_304_conserva_el_estado(self):
+        sincronizador = self.sincronizador()
+        sincronizador.sincronizar()
+        guardado = os.path.getmtime(self.ruta)
+
+        datos = sincronizador.sincronizar()
+
+        self.assertEqual(ServidorManifiesto.peticiones[1].get("If-None-Match"), '"m1"')
+        self.assertEqual(self.nombres(datos), ["Lluvia", "Fuego"])
+        self.assertEqual(sincronizador.estado['etag'], '"m1"')
+        self.assertEqual(os.path.getmtime(self.ruta), guardado)
+        self.assertIsNone(sincronizador.ultimo_error)
+        self.cache.liberar_medio.assert_not_called()
+
+    def test_200_con_cambios_libera_entradas_eliminadas_y_con_otra_url(self):
+        sincronizador = self.sincronizador()
+        sincronizador.sincronizar()
+
+        ServidorManifiesto.etag = '"m2"'
+        ServidorManifiesto.datos = manifiesto(
+            videos=[("Lluvia", "https://medios.test/lluvia-v2.mp4"), ("Noche", "https://medios.test/noche.mp4")],
+            sonidos=[("Río", "https://medios.test/rio.mp3")]
+        )
+        datos = sincronizador.sincronizar()
+
+        self.assertEqual(self.nombres(datos), ["Lluvia", "Noche"])
+        liberadas = {llamada.args[0] for llamada in self.cache.liberar_medio.call_args_list}
+        self.assertEqual(liberadas, {"https://medios.test/lluvia.mp4", "https://medios.test/fuego.mp4"})
+        # La copia local queda al día para el próximo arranque
+        self.assertEqual(self.sincronizador().estado['etag'], '"m2"')
+
+    def test_sin_red_usa_la_ultima_copia_buena(self):
+        self.sincronizador().sincronizar()
+        ServidorManifiesto.caido = True
+
+        sincronizador = self.sincronizador()
+        datos = sincronizador.sincronizar()
+
+        self.assertEqual(self.nombres(datos), ["Lluvia", "Fuego"])
+        self.assertIn("503", sincronizador.ultimo_error)
+        self.cache.liberar_medio.assert_not_called()
+
+    def test_primer_arranque_sin_red_parte_de_la_semilla(self):
+        with open(self.semilla, "w") as f:
+            json.dump(manifiesto(videos=[("Semilla", "https://medios.test/semilla.mp4")]), f)
+        ServidorManifiesto.caido = True
+
+        sincronizador = self.sincronizador()
+        datos = sincronizador.sincronizar()
+
+        self.assertEqual(self.nombres(datos), ["Semilla"])
+        self.assertIsNone(sincronizador.estado['etag'])
+        self.assertNotIn("If-None-Match", ServidorManifiesto.peticiones[0])
+
+    def test_entrega_copias_de_las_entradas(self):
+        sincronizador = self.sincronizador()
+        sincronizador.sincronizar()['videos'][0]['local_path'] = "/tmp/lluvia.mp4"
+
+        self.assertNotIn('local_path', sincronizador.sincronizar()['videos'][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
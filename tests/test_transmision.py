@@ -0,0 +1,148 @@
+"""manejar_transmision contra una API simulada con las fases intermedias de YouTube."""
+
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+DIRECTORIO = tempfile.mkdtemp(prefix="relax_test_")
+os.environ.setdefault("MEDIA_CACHE_DIR", os.path.join(DIRECTORIO, "media_cache"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class PeticionSimulada:
+    def __init__(self, funcion, **kwargs):
+        self.funcion = funcion
+        self.kwargs = kwargs
+
+    def execute(self):
+        return self.funcion(**self.kwargs)
+
+
+class ApiSimulada:
+    """Tras pedir testing/live el broadcast pasa `sondeos` consultas en testStarting/liveStarting.
+
+    Como YouTube, rechaza la transición a live si el broadcast aún no está en testing.
+    """
+
+    PERMITIDAS = {"testing": ("ready",), "live": ("testing",), "complete": ("testing", "live")}
+    INTERMEDIO = {"testing": "testStarting", "live": "liveStarting"}
+
+    def __init__(self, sondeos=2):
+        self.sondeos = sondeos
+        self.estado = "ready"
+        self.destino = None
+        self.pendientes = 0
+        self.transiciones = []
+
+    def liveStreams(self):
+        return SimpleNamespace(list=lambda **kwargs: PeticionSimulada(
+            lambda: {"items": [{"status": {"streamStatus": "active"}}]}
+        ))
+
+    def liveBroadcasts(self):
+        return SimpleNamespace(
+            transition=lambda **kwargs: PeticionSimulada(self.transicion, **kwargs),
+            list=lambda **kwargs: PeticionSimulada(self.consultar, **kwargs),
+            delete=lambda **kwargs: PeticionSimulada(lambda **_: "", **kwargs)
+        )
+
+    def transicion(self, broadcastStatus, id, part):
+        self.transiciones.append((broadcastStatus, self.estado))
+        if self.estado not in self.PERMITIDAS[broadcastStatus]:
+            raise HttpError(httplib2.Response({"status": 403}), b'{"error": {"message": "invalidTransition"}}')
+        self.destino = broadcastStatus
+        self.estado = self.INTERMEDIO.get(broadcastStatus, broadcastStatus)
+        self.pendientes = self.sondeos
+        return {"id": id, "status": {"lifeCycleStatus": self.estado}}
+
+    def consultar(self, id, part):
+        if self.pendientes:
+            self.pendientes -= 1
+        else:
+            self.estado = self.destino or self.estado
+        return {"items": [{"id": id, "status": {"lifeCycleStatus": self.estado}}]}
+
+
+class TestManejarTransmision(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(DIRECTORIO, ignore_errors=True)
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp(dir=DIRECTORIO)
+        main._libro_cuota = main.LibroCuota(ruta=os.path.join(directorio, "cuota.json"))
+        self.api = ApiSimulada()
+        self.youtube = main.YouTubeManager("prueba", servicio=self.api)
+        self.canal = mock.Mock(evento_salida=threading.Event(), respaldo=None, respaldo_pendiente=None)
+        self.canal.proceso.poll.return_value = None
+        for nombre in ("main.time.sleep", "main.construir_comando_ffmpeg"):
+            parche = mock.patch(nombre)
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def emitir(self, **extra):
+        ahora = main.datetime.utcnow()
+        stream_data = dict({
+            "broadcast_id": "b1",
+            "stream_id": "s1",
+            "ciclo_vida": main.CicloVidaBroadcast("b1"),
+            "start_time": ahora - timedelta(seconds=1),
+            "end_time": ahora + timedelta(seconds=0.3),
+            "claves_cache": [],
+            "terminado": threading.Event()
+        }, **extra)
+        self.supervisor = mock.Mock()
+        main.manejar_transmision(stream_data, self.youtube, self.canal, self.supervisor)
+        return stream_data
+
+    def test_live_espera_a_que_el_broadcast_este_en_testing(self):
+        # Inicio ya pasado (como un relevo): live se pide justo después de testing
+        stream_data = self.emitir()
+
+        self.assertEqual(self.api.transiciones, [
+            ("testing", "ready"), ("live", "testing"), ("complete", "live")
+        ])
+        estados = [estado for estado, _, _ in stream_data['ciclo_vida'].historial]
+        self.assertEqual(estados, ["created", "ready", "testing", "live", "complete"])
+
+    def test_testing_no_observado_elimina_el_broadcast(self):
+        self.api.sondeos = float("inf")
+        esperar = functools.partial(self.youtube.esperar_estado_broadcast, limite=0.05)
+        with mock.patch.object(self.youtube, "esperar_estado_broadcast", esperar):
+            stream_data = self.emitir()
+
+        self.assertEqual(self.api.transiciones, [("testing", "ready")])
+        self.assertEqual(stream_data['ciclo_vida'].estado, "complete")
+        self.assertIn("liveBroadcasts.delete", main.obtener_cuota().estado["por_operacion"])
+
+    def test_relevo_suelta_la_emision_anterior(self):
+        previo = {"terminado": threading.Event(), "terminado_en": main.time.monotonic()}
+        previo['terminado'].set()
+        stream_data = self.emitir(previo=previo)
+
+        self.assertIsNone(stream_data['previo'])
+        self.canal.registrar_fase.assert_any_call("hueco_relevo", mock.ANY)
+
+    def test_traspaso_suelta_el_sucesor_sin_liberar_el_canal(self):
+        stream_data = self.emitir(sucesor={"broadcast_id": "b2"})
+
+        self.assertNotIn('sucesor', stream_data)
+        self.assertTrue(stream_data['terminado'].is_set())
+        self.supervisor.liberar.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
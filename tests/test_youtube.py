@@ -0,0 +1,210 @@
+"""Flujo lote + bind de YouTubeManager contra HttpMockSequence de googleapiclient."""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+DIRECTORIO = tempfile.mkdtemp(prefix="relax_test_")
+os.environ.setdefault("MEDIA_CACHE_DIR", os.path.join(DIRECTORIO, "media_cache"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+LIMITE_LOTE = "batch_relax"
+
+
+def respuesta_lote(*partes):
+    """Cuerpo multipart/mixed con una respuesta JSON por petición del lote (ids 1, 2...)."""
+    cuerpo = ""
+    for i, datos in enumerate(partes, start=1):
+        cuerpo += (
+            f"--{LIMITE_LOTE}\r\n"
+            "Content-Type: application/http\r\n"
+            "Content-Transfer-Encoding: binary\r\n"
+            f"Content-ID: <response-lote + {i}>\r\n\r\n"
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: application/json\r\n\r\n"
+            f"{json.dumps(datos)}\r\n"
+        )
+    cabeceras = {"status": "200", "content-type": f"multipart/mixed; boundary={LIMITE_LOTE}"}
+    return cabeceras, cuerpo + f"--{LIMITE_LOTE}--\r\n"
+
+
+def respuesta(datos):
+    return ({"status": "200", "content-type": "application/json"}, json.dumps(datos))
+
+
+def estado_broadcast(broadcast_id, estado):
+    return respuesta({"items": [{"id": broadcast_id, "status": {"lifeCycleStatus": estado}}]})
+
+
+def stream(stream_id):
+    return {
+        "id": stream_id,
+        "cdn": {
+            "ingestionInfo": {
+                "ingestionAddress": "rtmp://a.rtmp.youtube.com/live2",
+                "backupIngestionAddress": "rtmp://b.rtmp.youtube.com/live2?backup=1",
+                "streamName": f"clave-{stream_id}"
+            }
+        }
+    }
+
+
+class HttpGrabado(HttpMockSequence):
+    """HttpMockSequence que además anota cada petición enviada."""
+
+    def __init__(self, iterable):
+        super().__init__(iterable)
+        self.peticiones = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=1, connection_type=None):
+        self.peticiones.append((method, uri, body))
+        return super().request(uri, method, body, headers, redirections, connection_type)
+
+
+class TestYouTubeManager(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(DIRECTORIO, ignore_errors=True)
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp(dir=DIRECTORIO)
+        main._libro_cuota = main.LibroCuota(ruta=os.path.join(self.directorio, "cuota.json"))
+
+    def gestor(self, respuestas, estado=None):
+        http = HttpGrabado(respuestas)
+        servicio = build("youtube", "v3", http=http, static_discovery=True)
+        youtube = main.YouTubeManager("prueba", servicio=servicio)
+        youtube.ruta_estado = os.path.join(self.directorio, "youtube_prueba.json")
+        if estado:
+            youtube.guardar_estado(estado)
+        return youtube, http
+
+    def test_primer_broadcast_crea_stream_reutilizable_en_el_lote(self):
+        youtube, http = self.gestor([
+            respuesta_lote({"id": "b1"}, stream("s1")),
+            respuesta({"id": "b1"})
+        ])
+        datos = youtube.crear_transmision("Título", None)
+
+        self.assertEqual(datos["broadcast_id"], "b1")
+        self.assertEqual(datos["stream_id"], "s1")
+        self.assertEqual(datos["rtmp"], "rtmp://a.rtmp.youtube.com/live2/clave-s1")
+        self.assertEqual(datos["rtmp_respaldo"], "rtmp://b.rtmp.youtube.com/live2?backup=1/clave-s1")
+        self.assertEqual(youtube.cargar_estado(), {"stream_id": "s1"})
+
+        self.assertEqual(len(http.peticiones), 2)
+        metodo, uri, cuerpo = http.peticiones[0]
+        self.assertIn("/batch", uri)
+        self.assertIn("POST /youtube/v3/liveBroadcasts", cuerpo)
+        self.assertIn("POST /youtube/v3/liveStreams", cuerpo)
+        self.assertIn('"isReusable": true', cuerpo)
+        metodo, uri, _ = http.peticiones[1]
+        self.assertIn("liveBroadcasts/bind", uri)
+        self.assertIn("streamId=s1", uri)
+
+        usado = main.obtener_cuota().estado["por_operacion"]
+        self.assertEqual(set(usado), {"liveBroadcasts.insert", "liveStreams.insert", "liveBroadcasts.bind"})
+
+    def test_stream_persistente_se_consulta_una_vez(self):
+        youtube, http = self.gestor([
+            respuesta_lote({"id": "b1"}, {"items": [stream("s1")]}),
+            respuesta({"id": "b1"}),
+            respuesta_lote({"id": "b2"}),
+            respuesta({"id": "b2"})
+        ], estado={"stream_id": "s1"})
+
+        primero = youtube.crear_transmision("Uno", None)
+        segundo = youtube.crear_transmision("Dos", None)
+
+        self.assertEqual(primero["stream_id"], "s1")
+        self.assertEqual(segundo["broadcast_id"], "b2")
+        self.assertEqual(segundo["rtmp"], primero["rtmp"])
+        self.assertIn("GET /youtube/v3/liveStreams", http.peticiones[0][2])
+        # En caliente el stream sale de la caché: el lote solo lleva el broadcast
+        self.assertNotIn("liveStreams", http.peticiones[2][2])
+        self.assertEqual(len(http.peticiones), 4)
+
+    def test_stream_persistente_desaparecido_se_recrea(self):
+        youtube, http = self.gestor([
+            respuesta_lote({"id": "b1"}, {"items": []}),
+            respuesta(stream("s2")),
+            respuesta({"id": "b1"})
+        ], estado={"stream_id": "s1"})
+
+        datos = youtube.crear_transmision("Título", None)
+
+        self.assertEqual(datos["stream_id"], "s2")
+        self.assertEqual(youtube.cargar_estado(), {"stream_id": "s2"})
+        self.assertIn("liveStreams", http.peticiones[1][1])
+        self.assertIn("streamId=s2", http.peticiones[2][1])
+
+    def test_relevo_no_se_autoarranca(self):
+        youtube, http = self.gestor([
+            respuesta_lote({"id": "b1"}, stream("s1")),
+            respuesta({"id": "b1"})
+        ])
+        youtube.crear_transmision("Relevo", None, inicio=main.datetime.utcnow())
+
+        self.assertIn('"enableAutoStart": false', http.peticiones[0][2])
+
+    def test_error_en_el_lote_no_crea_broadcast(self):
+        youtube, _ = self.gestor([
+            ({"status": "500", "content-type": "application/json"}, "{}")
+        ])
+        self.assertIsNone(youtube.crear_transmision("Título", None))
+
+    def test_broadcast_abandonado_antes_de_testing_se_elimina(self):
+        youtube, http = self.gestor([({"status": "204"}, "")])
+        datos = {'broadcast_id': "b1", 'ciclo_vida': main.CicloVidaBroadcast("b1")}
+        datos['ciclo_vida'].avanzar("ready")
+        main.cerrar_broadcast(youtube, datos)
+
+        metodo, uri, _ = http.peticiones[0]
+        self.assertEqual(metodo, "DELETE")
+        self.assertIn("liveBroadcasts?id=b1", uri)
+        self.assertEqual(datos['ciclo_vida'].estado, "complete")
+
+    def test_broadcast_en_testing_se_completa(self):
+        youtube, http = self.gestor([respuesta({"id": "b1"})])
+        datos = {'broadcast_id': "b1", 'ciclo_vida': main.CicloVidaBroadcast("b1")}
+        datos['ciclo_vida'].avanzar("ready")
+        datos['ciclo_vida'].avanzar("testing")
+        main.cerrar_broadcast(youtube, datos)
+
+        self.assertIn("broadcastStatus=complete", http.peticiones[0][1])
+        self.assertEqual(datos['ciclo_vida'].estado, "complete")
+
+    def test_espera_el_estado_del_broadcast_con_cuota(self):
+        youtube, http = self.gestor([
+            estado_broadcast("b1", "ready"),
+            estado_broadcast("b1", "testStarting"),
+            estado_broadcast("b1", "testing")
+        ])
+        with mock.patch("main.time.sleep") as dormir:
+            self.assertTrue(youtube.esperar_estado_broadcast("b1", "testing"))
+
+        self.assertEqual(len(http.peticiones), 3)
+        self.assertTrue(all("liveBroadcasts?part=status&id=b1" in uri for _, uri, _ in http.peticiones))
+        # Intervalos crecientes entre sondeos
+        esperas = [llamada.args[0] for llamada in dormir.call_args_list]
+        self.assertLess(esperas[0], esperas[1])
+        self.assertEqual(main.obtener_cuota().estado["por_operacion"], {"liveBroadcasts.list": 3})
+
+    def test_estado_no_observado_agota_la_espera(self):
+        youtube, _ = self.gestor([estado_broadcast("b1", "testStarting")] * 50)
+        with mock.patch("main.time.sleep"), mock.patch("main.time.monotonic", side_effect=range(0, 1000, 10)):
+            self.assertFalse(youtube.esperar_estado_broadcast("b1", "testing", limite=60))
+
+
+if __name__ == "__main__":
+    unittest.main()